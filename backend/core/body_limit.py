@@ -0,0 +1,53 @@
+from typing import Callable
+from fastapi import HTTPException
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# Caps the request body of the endpoints marked with max_body_size. By the
+# time an endpoint sees an UploadFile, Starlette has already parsed and
+# spooled the whole multipart body to a temp file, so a size check on the
+# file alone still lets an oversized request use its full disk and I/O.
+#
+# The limit is applied on the way in instead: a declared Content-Length over
+# it is refused before anything is read, and a chunked body is cut off as
+# soon as the bytes received pass it. Routing has run by the time the body is
+# first read, so the matched route's endpoint says which limit applies.
+
+def max_body_size(size: int) -> Callable:
+    def mark(endpoint: Callable) -> Callable:
+        endpoint.max_body_size = size
+        return endpoint
+    return mark
+
+def too_large(limit: int) -> HTTPException:
+    return HTTPException(status_code=413, detail=f"Request body larger than {limit} bytes")
+
+class BodySizeLimitMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        limit = None
+        received = 0
+
+        async def limited_receive() -> Message:
+            nonlocal limit, received
+            if limit is None:
+                endpoint = getattr(scope.get("route"), "endpoint", None)
+                limit = getattr(endpoint, "max_body_size", 0)
+                if limit:
+                    declared = dict(scope["headers"]).get(b"content-length")
+                    if declared is not None and declared.isdigit() and int(declared) > limit:
+                        raise too_large(limit)
+
+            message = await receive()
+            if limit and message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise too_large(limit)
+            return message
+
+        await self.app(scope, limited_receive, send)
@@ -0,0 +1,183 @@
+import os
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Optional
+
+try:
+    import redis.asyncio as redis
+except ImportError:
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+# Config
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory")
+CACHE_URL = os.getenv("CACHE_URL", "redis://localhost:6379/0")
+CACHE_TTL = float(os.getenv("CACHE_TTL", "60"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "10000"))
+
+class CacheStats:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def as_dict(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / total, 3) if total else 0.0,
+        }
+
+# Each delete bumps the key's generation. A reader takes the generation
+# before it reads the database and passes it to set, which drops the write
+# if a delete came in between, so a body read before a commit can't
+# overwrite the invalidation that followed it.
+
+# Per-process LRU with a TTL. Each worker has its own copy, so another
+# worker's write is only seen here once the entry expires.
+class MemoryCache:
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        # Generations of recently deleted keys, bounded like the entries.
+        # Values come from one counter, so an evicted key never repeats one.
+        self.generations: OrderedDict[str, int] = OrderedDict()
+        self.deletes = 0
+        self.lock = threading.Lock()
+        self.stats = CacheStats()
+
+    async def get(self, key: str) -> Optional[Any]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.stats.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self.entries[key]
+                self.stats.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.stats.hits += 1
+            return value
+
+    async def generation(self, key: str) -> Optional[int]:
+        with self.lock:
+            return self.generations.get(key, 0)
+
+    async def set(self, key: str, value: Any, generation: Optional[int]) -> None:
+        with self.lock:
+            if generation is None or self.generations.get(key, 0) != generation:
+                return
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.stats.evictions += 1
+
+    async def delete(self, *keys: str) -> None:
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+                self.deletes += 1
+                self.generations[key] = self.deletes
+                self.generations.move_to_end(key)
+            while len(self.generations) > self.max_entries:
+                self.generations.popitem(last=False)
+
+    def size(self) -> int:
+        return len(self.entries)
+
+# Sets the entry only if the generation key still holds the reader's value
+GUARDED_SET = """
+if (redis.call('GET', KEYS[2]) or '0') == ARGV[2] then
+    redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[3])
+end
+"""
+
+def generation_key(key: str) -> str:
+    return f"generation:{key}"
+
+# Shared cache for multi-worker deployments; evictions are left to Redis.
+# Generations live in their own keys, bumped by delete in every worker.
+class RedisCache:
+    def __init__(self, url: str, ttl: float):
+        self.client = redis.from_url(url)
+        self.ttl = ttl
+        self.stats = CacheStats()
+
+    async def get(self, key: str) -> Optional[Any]:
+        try:
+            raw = await self.client.get(key)
+        except Exception as e:
+            logger.warning("Cache get failed: %s", e)
+            raw = None
+        if raw is None:
+            self.stats.misses += 1
+            return None
+        self.stats.hits += 1
+        return json.loads(raw)
+
+    # None when Redis can't be reached, which makes the following set a no-op
+    async def generation(self, key: str) -> Optional[int]:
+        try:
+            return int(await self.client.get(generation_key(key)) or 0)
+        except Exception as e:
+            logger.warning("Cache generation read failed: %s", e)
+            return None
+
+    async def set(self, key: str, value: Any, generation: Optional[int]) -> None:
+        if generation is None:
+            return
+        try:
+            await self.client.eval(
+                GUARDED_SET, 2, key, generation_key(key),
+                json.dumps(value), str(generation), int(self.ttl * 1000),
+            )
+        except Exception as e:
+            logger.warning("Cache set failed: %s", e)
+
+    async def delete(self, *keys: str) -> None:
+        if not keys:
+            return
+        try:
+            async with self.client.pipeline(transaction=True) as pipe:
+                pipe.delete(*keys)
+                # Generation keys outlive any read in flight, then expire
+                for key in keys:
+                    pipe.incr(generation_key(key))
+                    pipe.pexpire(generation_key(key), int(self.ttl * 1000))
+                await pipe.execute()
+        except Exception as e:
+            logger.warning("Cache delete failed: %s", e)
+
+    def size(self) -> Optional[int]:
+        return None
+
+def build_cache():
+    if CACHE_BACKEND == "redis":
+        if redis is None:
+            raise RuntimeError("CACHE_BACKEND=redis requires the redis package")
+        return RedisCache(CACHE_URL, CACHE_TTL)
+    return MemoryCache(CACHE_MAX_ENTRIES, CACHE_TTL)
+
+cache = build_cache()
+
+def client_key(client_id: str) -> str:
+    return f"client:{client_id}"
+
+def guarantor_key(guarantor_id: str) -> str:
+    return f"guarantor:{guarantor_id}"
+
+def employee_key(employee_id: str) -> str:
+    return f"employee:{employee_id}"
+
+def cache_stats() -> dict:
+    return {"backend": CACHE_BACKEND, "entries": cache.size(), **cache.stats.as_dict()}
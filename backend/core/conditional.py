@@ -0,0 +1,166 @@
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Awaitable, Callable, NamedTuple, Optional
+from fastapi import HTTPException, Request, Response
+from sqlalchemy import func, null
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from core.cache import cache
+from core.rows import project, rows_response
+from models.client_model import EAT
+
+# Last-Modified only moves forward when something is added or edited. Once a
+# response embeds rows that can also be removed (children, list pages), a
+# removal leaves it where it was, so If-Modified-Since is only honoured for
+# dated versions and the rest revalidate by ETag alone.
+class Version(NamedTuple):
+    etag: str
+    last_modified: datetime
+    dated: bool = True
+
+def as_utc(value: datetime) -> datetime:
+    # Naive values come back from MySQL in the EAT wall time they were written in
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=EAT)
+    return value.astimezone(timezone.utc)
+
+# An entity's version covers its own updated_at plus the count and latest
+# updated_at of the children embedded in its response, so adding, editing or
+# removing a child also changes the parent's ETag. child_count is None for
+# entities without embedded children.
+def version_from(updated_at: datetime, child_count: Optional[int] = None, child_latest: Optional[datetime] = None) -> Version:
+    raw = f"{updated_at.isoformat()}|{child_count or 0}|{child_latest.isoformat() if child_latest else ''}"
+    etag = f'W/"{hashlib.sha1(raw.encode()).hexdigest()[:20]}"'
+    latest = max(updated_at, child_latest) if child_latest else updated_at
+    return Version(etag, as_utc(latest), dated=child_count is None)
+
+def object_version(obj, children: Optional[list] = None) -> Version:
+    updated_at = obj.updated_at or obj.created_at
+    if children is None:
+        return version_from(updated_at)
+    child_latest = max((child.updated_at or child.created_at for child in children), default=None)
+    return version_from(updated_at, len(children), child_latest)
+
+def list_version(versions: list[Version], extra: str = "") -> Version:
+    raw = "|".join(version.etag for version in versions) + "|" + extra
+    etag = f'W/"{hashlib.sha1(raw.encode()).hexdigest()[:20]}"'
+    latest = max((version.last_modified for version in versions), default=datetime.fromtimestamp(0, timezone.utc))
+    return Version(etag, latest, dated=False)
+
+# Selects only what version_from needs, so a 304 never loads the row itself
+def version_statement(model, id_col, entity_id: str, child_model=None, child_fk=None):
+    updated_at = func.coalesce(model.updated_at, model.created_at)
+    if child_model is None:
+        # Always three columns, so results unpack straight into version_from
+        return select(updated_at, null(), null()).where(id_col == entity_id)
+    child_updated = func.coalesce(child_model.updated_at, child_model.created_at)
+    return select(
+        updated_at,
+        select(func.count()).select_from(child_model).where(child_fk == id_col).scalar_subquery(),
+        select(func.max(child_updated)).where(child_fk == id_col).scalar_subquery(),
+    ).where(id_col == entity_id)
+
+def is_not_modified(request: Request, version: Version) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        # Weak comparison, as recommended for GET
+        current = version.etag.removeprefix("W/")
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or current in tags
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is not None and version.dated:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        return version.last_modified.replace(microsecond=0) <= since
+
+    return False
+
+def version_headers(version: Version) -> dict:
+    return {
+        "ETag": version.etag,
+        "Last-Modified": format_datetime(version.last_modified, usegmt=True),
+        "Cache-Control": "private, no-cache",
+    }
+
+def set_version_headers(response: Response, version: Version) -> None:
+    response.headers.update(version_headers(version))
+
+def not_modified_response(version: Version) -> Response:
+    return Response(status_code=304, headers=version_headers(version))
+
+def has_conditional_headers(request: Request) -> bool:
+    return "if-none-match" in request.headers or "if-modified-since" in request.headers
+
+# Cached single-entity responses keep their version next to the body
+def cache_entry(version: Version, body) -> dict:
+    return {
+        "etag": version.etag, "last_modified": version.last_modified.isoformat(),
+        "dated": version.dated, "body": body,
+    }
+
+def respond_from_cache(request: Request, response: Response, entry: dict):
+    version = Version(entry["etag"], datetime.fromisoformat(entry["last_modified"]), entry.get("dated", False))
+    if is_not_modified(request, version):
+        return not_modified_response(version)
+    set_version_headers(response, version)
+    return entry["body"]
+
+# Single-entity GET shared by the client, guarantor and employee routes:
+# cache lookup, revalidation, ?fields= projection and caching the full body.
+# read_fields returns the requested fields (None if the row is gone);
+# read_full returns the full body with its version (None if not found).
+async def conditional_entity_response(
+    request: Request,
+    response: Response,
+    session: AsyncSession,
+    key: str,
+    requested: Optional[list[str]],
+    validators_statement,
+    not_found: str,
+    read_fields: Callable[[list[str]], Awaitable[Optional[dict]]],
+    read_full: Callable[[], Awaitable[Optional[tuple[Version, dict]]]],
+):
+    cached = await cache.get(key)
+    if cached is not None:
+        result = respond_from_cache(request, response, cached)
+        if requested is None or isinstance(result, Response):
+            return result
+        return rows_response(project(result, requested), response)
+
+    # Taken before the first statement, which is when the transaction's
+    # snapshot is fixed; a delete after this point keeps the body read
+    # below out of the cache
+    generation = await cache.generation(key)
+
+    # Answer revalidation from updated_at alone, without loading the row.
+    # Partial reads use the same validators, so their ETag matches the full one.
+    if has_conditional_headers(request) or requested:
+        validators = (await session.exec(validators_statement)).first()
+        if not validators:
+            raise HTTPException(status_code=404, detail=not_found)
+        version = version_from(*validators)
+        if is_not_modified(request, version):
+            return not_modified_response(version)
+
+    # Only the requested columns are read; partial reads aren't cached
+    if requested:
+        data = await read_fields(requested)
+        if data is None:
+            raise HTTPException(status_code=404, detail=not_found)
+        set_version_headers(response, version)
+        return rows_response(project(data, requested), response)
+
+    full = await read_full()
+    if full is None:
+        raise HTTPException(status_code=404, detail=not_found)
+    version, data = full
+    await cache.set(key, cache_entry(version, data), generation)
+    set_version_headers(response, version)
+    return data
@@ -0,0 +1,62 @@
+import csv
+import io
+import json
+from enum import Enum
+from fastapi.responses import StreamingResponse
+from sqlmodel import Session, select
+
+from core.database import engine
+
+EXPORT_CHUNK_SIZE = 1000
+
+class ExportFormat(str, Enum):
+    ndjson = "ndjson"
+    csv = "csv"
+
+def to_plain(value):
+    if isinstance(value, Enum):
+        return value.value
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return value
+
+def iter_chunks(columns):
+    # The request session is gone by the time the body streams, so use our own.
+    # stream_results keeps a server-side cursor and yield_per bounds the buffer.
+    with Session(engine) as session:
+        result = session.execute(
+            select(*columns).execution_options(stream_results=True, yield_per=EXPORT_CHUNK_SIZE)
+        )
+        for rows in result.partitions():
+            yield [[to_plain(value) for value in row] for row in rows]
+
+def ndjson_lines(columns):
+    keys = [column.key for column in columns]
+    for chunk in iter_chunks(columns):
+        yield "".join(json.dumps(dict(zip(keys, row))) + "\n" for row in chunk)
+
+def csv_lines(columns):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([column.key for column in columns])
+    for chunk in iter_chunks(columns):
+        writer.writerows(chunk)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    # Header only, for an empty table
+    if buffer.tell():
+        yield buffer.getvalue()
+
+# Stream the given columns of a table as NDJSON or CSV without building the full result in memory
+def export_response(columns, export_format: ExportFormat, filename: str) -> StreamingResponse:
+    if export_format == ExportFormat.csv:
+        body, media_type = csv_lines(columns), "text/csv"
+    else:
+        body, media_type = ndjson_lines(columns), "application/x-ndjson"
+
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{export_format.value}"'},
+    )
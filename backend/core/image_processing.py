@@ -0,0 +1,213 @@
+import os
+import uuid
+import asyncio
+import contextlib
+import logging
+import threading
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from sqlalchemy import exists, or_, update
+from sqlalchemy.orm import aliased
+from sqlmodel import Session, select
+from PIL import Image, ImageOps
+
+from core.database import engine
+from core.cache import cache, guarantor_key
+from models.client_model import Guarantor_business_photos, PhotoStatus, EAT
+
+logger = logging.getLogger(__name__)
+
+# Config
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", str(min(2, os.cpu_count() or 1))))
+# Longest side of the re-encoded display image
+IMAGE_MAX_DIMENSION = int(os.getenv("IMAGE_MAX_DIMENSION", "1600"))
+IMAGE_WEBP_QUALITY = int(os.getenv("IMAGE_WEBP_QUALITY", "80"))
+# Thumbnails are cropped to a fixed square so list views lay out evenly
+THUMBNAIL_SIZE = int(os.getenv("IMAGE_THUMBNAIL_SIZE", "320"))
+THUMBNAIL_QUALITY = int(os.getenv("IMAGE_THUMBNAIL_QUALITY", "70"))
+POLL_INTERVAL = float(os.getenv("IMAGE_PROCESSOR_POLL_INTERVAL", "10"))
+BATCH_SIZE = int(os.getenv("IMAGE_PROCESSOR_BATCH_SIZE", "20"))
+MAX_ATTEMPTS = int(os.getenv("IMAGE_PROCESSOR_MAX_ATTEMPTS", "3"))
+# How long a claimed photo stays hidden from other processors before it is retried
+CLAIM_LEASE = float(os.getenv("IMAGE_PROCESSOR_CLAIM_LEASE", "300"))
+PROCESSOR_ENABLED = os.getenv("IMAGE_PROCESSOR_ENABLED", "true").lower() == "true"
+
+def derived_path(source_path: str, suffix: str) -> str:
+    stem = os.path.splitext(source_path)[0]
+    return f"{stem}_{suffix}.webp"
+
+# Written under a unique hidden temp name next to the target, as uploads are,
+# so concurrent writers never share it and it is never served half-written
+def _save_webp(image: Image.Image, path: str, quality: int) -> None:
+    temp_path = os.path.join(os.path.dirname(path), f".{uuid.uuid4()}.part")
+    try:
+        # Nothing from the source info is passed on, so EXIF, GPS and XMP are dropped
+        image.save(temp_path, "WEBP", quality=quality, method=4)
+        os.replace(temp_path, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(temp_path)
+        raise
+
+# Runs inside the pool workers. Writes a resized WebP for display and a square
+# thumbnail next to the original and returns both paths.
+def _process_image(source_path: str) -> tuple[str, str]:
+    with Image.open(source_path) as source:
+        # Apply the EXIF orientation before the metadata is thrown away
+        image = ImageOps.exif_transpose(source)
+        image = image.convert("RGBA" if image.mode in ("RGBA", "LA", "P") else "RGB")
+
+    display = image.copy()
+    display.thumbnail((IMAGE_MAX_DIMENSION, IMAGE_MAX_DIMENSION), Image.Resampling.LANCZOS)
+    display_path = derived_path(source_path, "display")
+    _save_webp(display, display_path, IMAGE_WEBP_QUALITY)
+
+    thumbnail = ImageOps.fit(image, (THUMBNAIL_SIZE, THUMBNAIL_SIZE), Image.Resampling.LANCZOS)
+    thumbnail_path = derived_path(source_path, "thumb")
+    _save_webp(thumbnail, thumbnail_path, THUMBNAIL_QUALITY)
+
+    return display_path, thumbnail_path
+
+image_executor = None
+image_executor_lock = threading.Lock()
+
+def get_image_executor() -> ProcessPoolExecutor:
+    global image_executor
+    with image_executor_lock:
+        if image_executor is None:
+            image_executor = ProcessPoolExecutor(max_workers=IMAGE_WORKERS)
+        return image_executor
+
+def shutdown_image_executor() -> None:
+    global image_executor
+    with image_executor_lock:
+        if image_executor is not None:
+            image_executor.shutdown(cancel_futures=True)
+            image_executor = None
+
+# Claim pending photos, hiding them from other processors for the lease so a
+# crashed processor doesn't lose them and a concurrent one doesn't redo them.
+# Duplicates of bytes already under lease are skipped: the run holding the
+# lease writes its result to every pending row with the same hash.
+def claim_pending_photos(session: Session, limit: int = BATCH_SIZE) -> list[Guarantor_business_photos]:
+    now = datetime.now(EAT)
+    Photo = Guarantor_business_photos
+    Leased = aliased(Guarantor_business_photos)
+    statement = (
+        select(Photo)
+        .where(Photo.processing_status == PhotoStatus.pending)
+        .where(or_(
+            Photo.processing_claimed_until.is_(None),
+            Photo.processing_claimed_until <= now,
+        ))
+        .where(~exists().where(
+            Leased.content_hash == Photo.content_hash,
+            Leased.processing_status == PhotoStatus.pending,
+            Leased.processing_claimed_until > now,
+        ))
+        .order_by(Photo.created_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    photos = session.exec(statement).all()
+
+    for photo in photos:
+        photo.processing_attempts += 1
+        photo.processing_claimed_until = now + timedelta(seconds=CLAIM_LEASE)
+
+    session.commit()
+    return list(photos)
+
+# Process one batch of pending photos. Returns the number of photos claimed
+# and the ids of the guarantors whose photos changed.
+def process_pending(limit: int = BATCH_SIZE) -> tuple[int, set[str]]:
+    Photo = Guarantor_business_photos
+    with Session(engine, expire_on_commit=False) as session:
+        photos = claim_pending_photos(session, limit)
+        if not photos:
+            return 0, set()
+
+        # Rows with the same hash share one file, so each hash is processed
+        # once. Photos from before content addressing go on their own.
+        groups: dict[str, list[Guarantor_business_photos]] = defaultdict(list)
+        for photo in photos:
+            groups[photo.content_hash or photo.image_id].append(photo)
+
+        executor = get_image_executor()
+        futures = {key: executor.submit(_process_image, group[0].link) for key, group in groups.items()}
+
+        changed_hashes, changed_ids = [], []
+        for key, group in groups.items():
+            try:
+                display_link, thumbnail_link = futures[key].result()
+                values = dict(
+                    display_link=display_link, thumbnail_link=thumbnail_link,
+                    processing_status=PhotoStatus.ready, processing_claimed_until=None,
+                )
+            except Exception as e:
+                # The lease is left in place, so the retry waits for it to run out
+                logger.warning("Processing photo %s failed: %s", group[0].image_id, e)
+                if max(photo.processing_attempts for photo in group) < MAX_ATTEMPTS:
+                    continue
+                values = dict(processing_status=PhotoStatus.failed)
+
+            # Plain UPDATEs, since the photo may have been deleted, row and
+            # all, by a database cascade while it was being processed. Pending
+            # duplicates that came in after the claim take the result too.
+            content_hash = group[0].content_hash
+            result = session.execute(
+                update(Photo)
+                .where(Photo.content_hash == key if content_hash else Photo.image_id == key)
+                .where(Photo.processing_status == PhotoStatus.pending)
+                .values(**values)
+            )
+            if result.rowcount and content_hash:
+                changed_hashes.append(key)
+            elif result.rowcount:
+                changed_ids.append(key)
+
+        # One read for the guarantors of every row that was updated
+        guarantor_ids = set()
+        if changed_hashes or changed_ids:
+            guarantor_ids = set(session.exec(
+                select(Photo.guarantor_id).where(or_(Photo.content_hash.in_(changed_hashes), Photo.image_id.in_(changed_ids)))
+            ).all())
+
+        session.commit()
+        return len(photos), guarantor_ids
+
+# Set by the upload route so new photos are picked up without waiting for the next poll
+photos_queued = asyncio.Event()
+
+def notify_photos_queued() -> None:
+    photos_queued.set()
+
+async def run_image_processor(stop_event: asyncio.Event) -> None:
+    while not stop_event.is_set():
+        photos_queued.clear()
+        try:
+            processed, guarantor_ids = await asyncio.to_thread(process_pending)
+        except Exception as e:
+            logger.error("Photo processing failed: %s", e)
+            processed, guarantor_ids = 0, set()
+
+        await cache.delete(*(guarantor_key(guarantor_id) for guarantor_id in guarantor_ids))
+
+        # Drain a backlog without waiting
+        if processed >= BATCH_SIZE:
+            continue
+
+        # Sleep until the next poll, a new upload or shutdown
+        waiters = [asyncio.create_task(stop_event.wait()), asyncio.create_task(photos_queued.wait())]
+        await asyncio.wait(waiters, timeout=POLL_INTERVAL, return_when=asyncio.FIRST_COMPLETED)
+        for waiter in waiters:
+            waiter.cancel()
+
+# Run the processor as its own process: python -m core.image_processing
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(run_image_processor(asyncio.Event()))
+    finally:
+        shutdown_image_executor()
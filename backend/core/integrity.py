@@ -0,0 +1,32 @@
+from typing import Optional
+from fastapi import HTTPException
+from sqlalchemy.exc import IntegrityError
+
+# Writes rely on the database's unique and foreign key constraints instead of
+# checking first with a SELECT. This turns the violation back into the client
+# error it stands for, from the column named in the driver's message:
+#   MySQL:      Duplicate entry '...' for key 'client.ix_client_national_id_number'
+#   SQLite:     UNIQUE constraint failed: client.national_id_number
+#   PostgreSQL: duplicate key value violates unique constraint "ix_client_national_id_number"
+# SQLite doesn't name the column of a failed foreign key, so a single
+# reference is assumed to be the one that failed. A malformed id binds as
+# NULL, so a NOT NULL failure on a reference means the same thing.
+def integrity_http_error(
+    error: IntegrityError,
+    unique: dict[str, str],
+    references: Optional[dict[str, str]] = None,
+) -> HTTPException:
+    message = str(error.orig).lower()
+    references = references or {}
+
+    for column, detail in references.items():
+        named = column in message
+        if "foreign key" in message and (named or len(references) == 1):
+            return HTTPException(status_code=404, detail=detail)
+        if named and "null" in message:
+            return HTTPException(status_code=404, detail=detail)
+
+    for column, detail in unique.items():
+        if column in message:
+            return HTTPException(status_code=409, detail=detail)
+    return HTTPException(status_code=409, detail="Conflicts with an existing record")
@@ -0,0 +1,129 @@
+import os
+import time
+from typing import Any
+from anyio import to_thread
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess,
+)
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# Config
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+# With several worker processes (gunicorn -w N), point this at an empty
+# directory shared by the workers before they start. Each process writes its
+# samples there and /metrics merges them, whichever worker serves the scrape.
+# Clear it on every deploy, and call mark_process_dead from gunicorn's
+# child_exit hook so live gauges drop the exited worker.
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+# Reading the threadpool limiter costs more than the rest of the middleware
+# together, so it is sampled at most this often per process
+THREADPOOL_SAMPLE_INTERVAL = float(os.getenv("METRICS_THREADPOOL_SAMPLE_INTERVAL", "1"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# HTTP
+http_request_duration = Histogram(
+    "http_request_duration_seconds", "Request latency by route template",
+    ["method", "route", "status"], buckets=LATENCY_BUCKETS,
+)
+http_requests_in_progress = Gauge(
+    "http_requests_in_progress", "Requests being handled", multiprocess_mode="livesum",
+)
+# Sync routes and run_in_threadpool borrow from AnyIO's default limiter
+threadpool_threads_in_use = Gauge(
+    "threadpool_threads_in_use", "Threadpool tokens borrowed, sampled during requests", multiprocess_mode="livesum",
+)
+threadpool_threads_total = Gauge(
+    "threadpool_threads_total", "Threadpool size", multiprocess_mode="livesum",
+)
+
+# Database
+db_pool_size = Gauge("db_pool_size", "Configured pool size", ["engine"], multiprocess_mode="livesum")
+db_pool_checked_out = Gauge(
+    "db_pool_connections_checked_out", "Connections in use", ["engine"], multiprocess_mode="livesum",
+)
+db_pool_wait = Histogram(
+    "db_pool_wait_seconds", "Time spent waiting for a pooled connection",
+    ["engine"], buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10),
+)
+db_pool_timeouts = Counter("db_pool_timeouts", "Checkouts that gave up waiting", ["engine"])
+db_query_duration = Histogram("db_query_duration_seconds", "Statement execution time", buckets=LATENCY_BUCKETS)
+
+# Password hashing, timed inside the pool worker so queueing isn't counted
+password_hash_duration = Histogram(
+    "password_hash_duration_seconds", "Argon2 time per password",
+    ["operation"], buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+password_hash_queue_depth = Gauge(
+    "password_hash_queue_depth", "Hashing jobs submitted to the pool and not yet finished", multiprocess_mode="livesum",
+)
+
+# SMS gateway
+sms_request_duration = Histogram(
+    "sms_request_duration_seconds", "Gateway request latency", ["outcome"], buckets=LATENCY_BUCKETS,
+)
+sms_messages = Counter("sms_messages", "Recipients by gateway status", ["status"])
+
+def mark_process_dead(pid: int) -> None:
+    if MULTIPROC_DIR:
+        multiprocess.mark_process_dead(pid)
+
+def render_metrics() -> tuple[bytes, str]:
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+threadpool_sampled_at = 0.0
+
+def sample_threadpool(now: float) -> None:
+    global threadpool_sampled_at
+    if now - threadpool_sampled_at < THREADPOOL_SAMPLE_INTERVAL:
+        return
+    threadpool_sampled_at = now
+    limiter = to_thread.current_default_thread_limiter()
+    threadpool_threads_in_use.set(limiter.borrowed_tokens)
+    threadpool_threads_total.set(limiter.total_tokens)
+
+# labels() looks up the child series under a lock on every call, so the
+# children are kept per (method, route, status)
+request_duration_children: dict[tuple[str, str, str], Any] = {}
+
+def request_duration_child(method: str, route: str, status: str):
+    key = (method, route, status)
+    child = request_duration_children.get(key)
+    if child is None:
+        child = request_duration_children[key] = http_request_duration.labels(method, route, status)
+    return child
+
+# Latency per route template rather than per path, so ids in URLs don't
+# create a series each. Plain ASGI, to keep the per-request cost to a few
+# microseconds.
+class MetricsMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        http_requests_in_progress.inc()
+        sample_threadpool(started)
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            http_requests_in_progress.dec()
+            route = getattr(scope.get("route"), "path", "unmatched")
+            request_duration_child(scope["method"], route, str(status_code)).observe(time.perf_counter() - started)
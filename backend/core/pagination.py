@@ -0,0 +1,59 @@
+import base64
+import json
+from datetime import datetime
+from typing import Optional
+from fastapi import HTTPException, Response
+from sqlalchemy import and_, or_
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# Opaque cursor holding the sort key of the last row of a page
+def encode_cursor(created_at: datetime, entity_id: str) -> str:
+    raw = json.dumps([created_at.isoformat(), entity_id])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor: str) -> tuple[datetime, str]:
+    try:
+        created_at, entity_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(created_at), entity_id
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def filter_created_range(statement, created_col, created_from: Optional[datetime], created_to: Optional[datetime]):
+    if created_from:
+        statement = statement.where(created_col >= created_from)
+    if created_to:
+        statement = statement.where(created_col < created_to)
+    return statement
+
+# Keyset pagination on (created_at, id), so every page is an index range scan
+# no matter how deep into the table it is. The next cursor is returned in the
+# X-Next-Cursor header and is absent on the last page.
+async def paginate(
+    session: AsyncSession,
+    statement,
+    created_col,
+    id_col,
+    limit: int,
+    cursor: Optional[str],
+    response: Response,
+) -> list:
+    if cursor:
+        created_at, entity_id = decode_cursor(cursor)
+        statement = statement.where(
+            or_(created_col > created_at, and_(created_col == created_at, id_col > entity_id))
+        )
+
+    statement = statement.order_by(created_col, id_col).limit(limit + 1)
+    rows = list((await session.exec(statement)).all())
+
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        response.headers["X-Next-Cursor"] = encode_cursor(
+            getattr(last, created_col.key), getattr(last, id_col.key)
+        )
+
+    return rows
@@ -0,0 +1,265 @@
+import os
+import re
+import time
+import asyncio
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Iterator, Optional
+from sqlalchemy import delete, exists, or_
+from sqlmodel import Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from core.database import engine, async_engine
+from core.image_processing import derived_path
+from core.photo_serving import UPLOAD_DIR
+from core.uploads import ReleasedPhoto
+from models.client_model import Guarantor_business_photos, PhotoBlob, EAT
+from models.timestamps import stored_now
+
+logger = logging.getLogger(__name__)
+
+# Config
+GC_INTERVAL = float(os.getenv("PHOTO_GC_INTERVAL", "3600"))
+# Files younger than this are never collected, so uploads and processing that
+# haven't committed their rows yet are left alone
+GC_GRACE_PERIOD = float(os.getenv("PHOTO_GC_GRACE_PERIOD", "3600"))
+# Files checked against the database per query
+GC_BATCH_SIZE = int(os.getenv("PHOTO_GC_BATCH_SIZE", "500"))
+GC_ENABLED = os.getenv("PHOTO_GC_ENABLED", "true").lower() == "true"
+
+CONTENT_NAME = re.compile(r"^([0-9a-f]{64})(?:_display|_thumb)?\.")
+
+class GcStats:
+    def __init__(self):
+        self.removed_files = 0
+        self.reclaimed_bytes = 0
+        self.removed_blobs = 0
+        self.last_run: Optional[dict] = None
+        self.lock = threading.Lock()
+
+    def record(self, files: int, reclaimed: int, blobs: int = 0) -> None:
+        with self.lock:
+            self.removed_files += files
+            self.reclaimed_bytes += reclaimed
+            self.removed_blobs += blobs
+
+    def as_dict(self) -> dict:
+        return {
+            "removed_files": self.removed_files,
+            "reclaimed_bytes": self.reclaimed_bytes,
+            "removed_blobs": self.removed_blobs,
+            "last_run": self.last_run,
+        }
+
+gc_stats = GcStats()
+
+# Walks the upload directory lazily, so memory doesn't grow with the number of files
+def iter_files(directory: str) -> Iterator[os.DirEntry]:
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    yield from iter_files(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    yield entry
+    except FileNotFoundError:
+        return
+
+def iter_batches(entries: Iterator[os.DirEntry], size: int) -> Iterator[list[os.DirEntry]]:
+    batch = []
+    for entry in entries:
+        batch.append(entry)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+# Paths in the batch that some photo row still points at. Content addressed
+# files are matched on the indexed hash, older uuid files on their paths.
+def referenced_paths(session: Session, paths: list[str]) -> set[str]:
+    Photo = Guarantor_business_photos
+    hashes = {match.group(1) for path in paths if (match := CONTENT_NAME.match(os.path.basename(path)))}
+    rows = session.exec(
+        select(Photo.content_hash, Photo.link, Photo.display_link, Photo.thumbnail_link).where(or_(
+            Photo.content_hash.in_(hashes),
+            Photo.link.in_(paths),
+            Photo.display_link.in_(paths),
+            Photo.thumbnail_link.in_(paths),
+        ))
+    ).all()
+
+    referenced = set()
+    found_hashes = set()
+    for content_hash, *links in rows:
+        referenced.update(link for link in links if link)
+        if content_hash:
+            found_hashes.add(content_hash)
+    for path in paths:
+        match = CONTENT_NAME.match(os.path.basename(path))
+        if match and match.group(1) in found_hashes:
+            referenced.add(path)
+    return referenced
+
+def remove_file(path: str) -> int:
+    try:
+        size = os.path.getsize(path)
+        os.remove(path)
+        return size
+    except FileNotFoundError:
+        return 0
+
+# Blob rows nobody has referenced for the whole grace period
+def delete_dead_blobs(session: Session, cutoff: datetime) -> int:
+    result = session.execute(
+        delete(PhotoBlob)
+        .where(PhotoBlob.ref_count <= 0)
+        .where(PhotoBlob.updated_at < cutoff)
+        .where(~exists().where(Guarantor_business_photos.content_hash == PhotoBlob.content_hash))
+    )
+    session.commit()
+    return result.rowcount
+
+# Removes the unreferenced candidates of one batch and returns their sizes
+# and the number of blob rows deleted with them. The mtimes read during the
+# walk may be stale by now: a duplicate upload can have touched a file and
+# taken a reference on its blob without its photo row being committed yet.
+# So the batch's blob rows are locked first, blobs still referenced keep
+# their files, and each file is stat'ed again right before it is unlinked.
+# Blob rows at zero go with their files, under the same lock, so an upload
+# waiting on them creates a new blob and puts its own copy back.
+def remove_unreferenced(session: Session, paths: list[str], cutoff: float) -> tuple[list[int], int]:
+    hashes = {path: match.group(1) for path in paths if (match := CONTENT_NAME.match(os.path.basename(path)))}
+    ref_counts = dict(session.exec(
+        select(PhotoBlob.content_hash, PhotoBlob.ref_count)
+        .where(PhotoBlob.content_hash.in_(set(hashes.values())))
+        .with_for_update()
+    ).all())
+
+    sizes = []
+    dead = set()
+    for path in paths:
+        content_hash = hashes.get(path)
+        if ref_counts.get(content_hash, 0) > 0:
+            continue
+        try:
+            if os.path.getmtime(path) >= cutoff:
+                continue
+        except FileNotFoundError:
+            continue
+        sizes.append(remove_file(path))
+        if content_hash in ref_counts:
+            dead.add(content_hash)
+
+    if dead:
+        session.execute(delete(PhotoBlob).where(PhotoBlob.content_hash.in_(dead)))
+    session.commit()
+    return sizes, len(dead)
+
+# One full pass over the upload directory. Returns a report of what was removed.
+def collect_garbage(directory: str = UPLOAD_DIR) -> dict:
+    started = time.monotonic()
+    cutoff = time.time() - GC_GRACE_PERIOD
+    scanned = removed = reclaimed = 0
+
+    with Session(engine) as session:
+        blobs = delete_dead_blobs(session, stored_now() - timedelta(seconds=GC_GRACE_PERIOD))
+
+        for batch in iter_batches(iter_files(directory), GC_BATCH_SIZE):
+            scanned += len(batch)
+            candidates = [entry.path for entry in batch if entry.stat(follow_symlinks=False).st_mtime < cutoff]
+            if not candidates:
+                continue
+
+            referenced = referenced_paths(session, candidates)
+            # Committed per batch, so no snapshot or lock is held across the whole walk
+            sizes, dead = remove_unreferenced(session, [path for path in candidates if path not in referenced], cutoff)
+            removed += len(sizes)
+            reclaimed += sum(sizes)
+            blobs += dead
+
+    gc_stats.record(removed, reclaimed, blobs)
+    report = {
+        "scanned_files": scanned,
+        "removed_files": removed,
+        "reclaimed_bytes": reclaimed,
+        "removed_blobs": blobs,
+        "duration_s": round(time.monotonic() - started, 3),
+        "finished_at": datetime.now(EAT).isoformat(),
+    }
+    gc_stats.last_run = report
+    logger.info("Photo GC removed %d of %d files, reclaimed %d bytes", removed, scanned, reclaimed)
+    return report
+
+# Derived files are included even if processing never recorded them
+def photo_file_paths(photo: ReleasedPhoto) -> list[str]:
+    return [photo.link, derived_path(photo.link, "display"), derived_path(photo.link, "thumb")]
+
+# A blob's original modified within the grace period was just uploaded again,
+# by a request that found the file on disk and may be about to take a new
+# reference on it. Its files are left for collect_garbage.
+def remove_blob_files(photo: ReleasedPhoto, cutoff: float) -> list[int]:
+    try:
+        if os.path.getmtime(photo.link) >= cutoff:
+            return []
+    except FileNotFoundError:
+        pass
+    return [remove_file(path) for path in photo_file_paths(photo)]
+
+# Run after a delete has committed. Files of older photos belong to that photo
+# alone and go straight away; a blob's files go once its last reference is
+# gone and its row can be deleted, which a concurrent upload of the same bytes
+# would prevent, and only if the same grace period as collect_garbage has
+# passed since the file was last written or touched.
+async def discard_photo_files(released: list[ReleasedPhoto]) -> None:
+    paths = []
+    blobs = []
+    hashes = set()
+    for photo in released:
+        if photo.content_hash:
+            hashes.add(photo.content_hash)
+        else:
+            paths.extend(photo_file_paths(photo))
+
+    if hashes:
+        async with AsyncSession(async_engine) as session:
+            # Dead blobs are locked before they're deleted, so an upload of the
+            # same bytes either bumps them first or waits and creates new ones
+            dead = set((await session.exec(
+                select(PhotoBlob.content_hash)
+                .where(PhotoBlob.content_hash.in_(hashes))
+                .where(PhotoBlob.ref_count <= 0)
+                .where(~exists().where(Guarantor_business_photos.content_hash == PhotoBlob.content_hash))
+                .with_for_update()
+            )).all())
+            if dead:
+                await session.execute(delete(PhotoBlob).where(PhotoBlob.content_hash.in_(dead)))
+            await session.commit()
+
+        gc_stats.record(0, 0, len(dead))
+        blobs = [next(p for p in released if p.content_hash == content_hash) for content_hash in dead]
+
+    if paths or blobs:
+        cutoff = time.time() - GC_GRACE_PERIOD
+        sizes = await asyncio.to_thread(lambda: [remove_file(path) for path in paths] + [
+            size for photo in blobs for size in remove_blob_files(photo, cutoff)
+        ])
+        gc_stats.record(sum(1 for size in sizes if size), sum(sizes))
+
+async def run_photo_gc(stop_event: asyncio.Event) -> None:
+    while not stop_event.is_set():
+        try:
+            await asyncio.to_thread(collect_garbage)
+        except Exception as e:
+            logger.error("Photo GC failed: %s", e)
+
+        try:
+            await asyncio.wait_for(stop_event.wait(), timeout=GC_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+# Run a single pass from the command line: python -m core.photo_gc
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    print(collect_garbage())
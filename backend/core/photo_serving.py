@@ -0,0 +1,53 @@
+import os
+from typing import Optional
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from starlette.responses import FileResponse, Response
+
+# Where guarantor photos are stored and the URL they are served under
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads/guarantors")
+PHOTO_URL_PREFIX = os.getenv("PHOTO_URL_PREFIX", "/photos")
+# Optional hand-off to the front proxy, which then sends the file itself with
+# sendfile. Set PHOTO_SENDFILE_HEADER to X-Accel-Redirect for nginx (with
+# PHOTO_SENDFILE_PREFIX pointing at an internal location) or X-Sendfile for
+# Apache. Left empty, files are streamed from Python.
+PHOTO_SENDFILE_HEADER = os.getenv("PHOTO_SENDFILE_HEADER", "")
+PHOTO_SENDFILE_PREFIX = os.getenv("PHOTO_SENDFILE_PREFIX", "/protected/guarantors/")
+
+# Stored files are never rewritten: blobs are named by their content hash and
+# older photos by a uuid, so clients can keep them for good.
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+def photo_url(path: Optional[str]) -> Optional[str]:
+    if not path or not path.startswith(UPLOAD_DIR):
+        return path
+    relative = os.path.relpath(path, UPLOAD_DIR).replace(os.sep, "/")
+    return f"{PHOTO_URL_PREFIX}/{relative}"
+
+class PhotoFiles(StaticFiles):
+    async def get_response(self, path: str, scope) -> Response:
+        # Temp files of uploads still in progress are never served
+        if os.path.basename(path).startswith("."):
+            raise HTTPException(status_code=404)
+        return await super().get_response(path, scope)
+
+    def file_response(self, full_path, stat_result: os.stat_result, scope, status_code: int = 200) -> Response:
+        # The file name is unique per content, so it doubles as a strong ETag
+        headers = {
+            "ETag": f'"{os.path.splitext(os.path.basename(full_path))[0]}"',
+            "Cache-Control": IMMUTABLE_CACHE_CONTROL,
+        }
+
+        if PHOTO_SENDFILE_HEADER:
+            relative = os.path.relpath(full_path, os.path.realpath(str(self.directory))).replace(os.sep, "/")
+            response = Response(status_code=status_code, headers=headers)
+            response.headers[PHOTO_SENDFILE_HEADER] = PHOTO_SENDFILE_PREFIX + relative
+        else:
+            # FileResponse answers Range requests with 206 and partial content
+            response = FileResponse(full_path, status_code=status_code, stat_result=stat_result)
+            response.headers.update(headers)
+
+        if self.is_not_modified(response.headers, Headers(scope=scope)):
+            return Response(status_code=304, headers=headers)
+        return response
@@ -0,0 +1,72 @@
+from collections import defaultdict
+from typing import Any, Optional
+import orjson
+from fastapi import HTTPException, Response
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+# Read path for list endpoints that skips ORM instances and response_model
+# validation: plain column rows go straight to dicts and out through orjson.
+
+# orjson encodes datetime, date and str enums the way the schemas would,
+# including Pydantic's "Z" suffix for UTC
+class FastJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_UTC_Z)
+
+FIELDS_DESCRIPTION = "Comma separated list of fields to return. Defaults to all fields."
+
+# Parses a ?fields=a,b sparse fieldset against a response schema. Returns None
+# when the parameter wasn't given, otherwise the fields in schema order.
+def parse_fields(fields: Optional[str], schema: type[BaseModel]) -> Optional[list[str]]:
+    if fields is None:
+        return None
+    requested = {field.strip() for field in fields.split(",") if field.strip()}
+    unknown = requested - set(schema.model_fields)
+    if unknown:
+        raise HTTPException(status_code=422, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    if not requested:
+        raise HTTPException(status_code=422, detail="No fields requested")
+    return [field for field in schema.model_fields if field in requested]
+
+# Table columns backing the fields of a response schema, in schema order,
+# optionally restricted to a sparse fieldset
+def schema_columns(model, schema: type[BaseModel], fields: Optional[list[str]] = None) -> list:
+    table_columns = model.__table__.columns
+    names = fields if fields is not None else schema.model_fields
+    return [getattr(model, name) for name in names if name in table_columns]
+
+# Adds columns needed for paging or ETags without returning them
+def with_columns(columns: list, *extra) -> list:
+    keys = {column.key for column in columns}
+    return columns + [column for column in extra if column.key not in keys]
+
+def schema_fields(schema: type[BaseModel]) -> list[str]:
+    return list(schema.model_fields)
+
+def row_dict(row, fields: list[str]) -> dict:
+    return {field: getattr(row, field) for field in fields}
+
+def project(data: dict, fields: list[str]) -> dict:
+    return {field: data[field] for field in fields}
+
+# Child rows for a page of parents in one IN query, grouped by parent id
+async def fetch_children(session: AsyncSession, parent_col, parent_ids: list[str], columns: list, order_by: list) -> dict[str, list]:
+    children = defaultdict(list)
+    if not parent_ids:
+        return children
+    rows = (await session.exec(
+        select(parent_col, *columns)
+        .where(parent_col.in_(parent_ids))
+        .order_by(parent_col, *order_by)
+    )).all()
+    for row in rows:
+        children[row[0]].append(row)
+    return children
+
+# Carries over headers set on the injected response, such as X-Next-Cursor and ETag
+def rows_response(content, response: Response) -> FastJSONResponse:
+    headers = {key: value for key, value in response.headers.items() if key != "content-length"}
+    return FastJSONResponse(content, headers=headers)
@@ -1,6 +1,12 @@
 import os
+import time
 import uuid
+import asyncio
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from functools import partial
 from pwdlib import PasswordHash
+from pwdlib.hashers.argon2 import Argon2Hasher
 from datetime import datetime, timedelta
 from typing import Optional
 from dotenv import load_dotenv
@@ -9,12 +15,157 @@ from fastapi.security import OAuth2PasswordBearer
 from sqlmodel import Session
 
 from core.database import get_session
+from core.metrics import password_hash_duration, password_hash_queue_depth
 load_dotenv()
 
-password_hash = PasswordHash.recommended()
+# Argon2 parameters, tunable per deployment. Hashes made with other
+# parameters still verify and get upgraded on the next successful login.
+ARGON2_TIME_COST = int(os.getenv("ARGON2_TIME_COST", "3"))
+ARGON2_MEMORY_COST = int(os.getenv("ARGON2_MEMORY_COST", "65536"))
+ARGON2_PARALLELISM = int(os.getenv("ARGON2_PARALLELISM", "4"))
 
-def hash_password(password):
+# Hashing runs in its own process pool so it never competes with request threads for the GIL
+HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Requests beyond this many queued hashes are turned away instead of piling up
+HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", str(HASH_WORKERS * 8)))
+HASH_BULK_CHUNK = int(os.getenv("PASSWORD_HASH_BULK_CHUNK", "16"))
+
+password_hash = PasswordHash((
+    Argon2Hasher(
+        time_cost=ARGON2_TIME_COST,
+        memory_cost=ARGON2_MEMORY_COST,
+        parallelism=ARGON2_PARALLELISM,
+    ),
+))
+
+# These run inside the pool workers
+def _hash(password: str) -> str:
     return password_hash.hash(password)
 
+def _hash_many(passwords: list[str]) -> list[str]:
+    return [password_hash.hash(password) for password in passwords]
+
+def _verify_and_update(plain_password: str, hashed_password: str) -> tuple[bool, Optional[str]]:
+    return password_hash.verify_and_update(plain_password, hashed_password)
+
+# Runs the job in the worker and times it there, so queueing isn't counted
+def _timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+HASH_OPERATIONS = {_hash: "hash", _hash_many: "hash", _verify_and_update: "verify"}
+
+hash_executor = None
+hash_executor_lock = threading.Lock()
+pending_hashes = 0
+
+def get_hash_executor() -> ProcessPoolExecutor:
+    global hash_executor
+    with hash_executor_lock:
+        if hash_executor is None:
+            hash_executor = ProcessPoolExecutor(max_workers=HASH_WORKERS)
+        return hash_executor
+
+def shutdown_hash_executor() -> None:
+    global hash_executor
+    with hash_executor_lock:
+        if hash_executor is not None:
+            hash_executor.shutdown(cancel_futures=True)
+            hash_executor = None
+
+# queue_depth is the number of jobs submitted to the pool and not yet finished
+def hash_pool_stats() -> dict:
+    return {
+        "workers": HASH_WORKERS,
+        "queue_depth": pending_hashes,
+        "max_pending": HASH_MAX_PENDING,
+    }
+
+def _release(_future) -> None:
+    global pending_hashes
+    with hash_executor_lock:
+        pending_hashes -= 1
+        password_hash_queue_depth.set(pending_hashes)
+
+# Unwraps the timed result into the future handed to the caller
+def _finish(future: Future, operation: str, passwords: int, timed: Future) -> None:
+    _release(timed)
+    if timed.cancelled():
+        future.cancel()
+        return
+    error = timed.exception()
+    if error is not None:
+        future.set_exception(error)
+        return
+    result, elapsed = timed.result()
+    for _ in range(passwords):
+        password_hash_duration.labels(operation).observe(elapsed / passwords)
+    future.set_result(result)
+
+def submit_hashing(fn, *args, bounded: bool = True):
+    global pending_hashes
+    executor = get_hash_executor()
+    with hash_executor_lock:
+        if bounded and pending_hashes >= HASH_MAX_PENDING:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many password operations in progress, try again shortly",
+            )
+        pending_hashes += 1
+        password_hash_queue_depth.set(pending_hashes)
+    try:
+        timed = executor.submit(_timed, fn, *args)
+    except Exception:
+        _release(None)
+        raise
+    future = Future()
+    passwords = len(args[0]) if fn is _hash_many else 1
+    timed.add_done_callback(partial(_finish, future, HASH_OPERATIONS[fn], passwords))
+    return future
+
+def hash_password(password):
+    return submit_hashing(_hash, password).result()
+
 def verify_password(plain_password, hashed_password):
-    return password_hash.verify(plain_password, hashed_password)
\ No newline at end of file
+    valid, _ = verify_and_update_password(plain_password, hashed_password)
+    return valid
+
+# Returns whether the password matches, plus a fresh hash when the stored one
+# was made with outdated parameters and should be saved back.
+def verify_and_update_password(plain_password, hashed_password) -> tuple[bool, Optional[str]]:
+    return submit_hashing(_verify_and_update, plain_password, hashed_password).result()
+
+# Hash many passwords, keeping at most one chunk per worker in flight so
+# single-password requests can still get a worker between chunks.
+def hash_passwords(passwords: list[str]) -> list[str]:
+    chunks = [passwords[i:i + HASH_BULK_CHUNK] for i in range(0, len(passwords), HASH_BULK_CHUNK)]
+    results: list[Optional[list[str]]] = [None] * len(chunks)
+    in_flight = {}
+    next_chunk = 0
+
+    while next_chunk < len(chunks) or in_flight:
+        while next_chunk < len(chunks) and len(in_flight) < HASH_WORKERS:
+            future = submit_hashing(_hash_many, chunks[next_chunk], bounded=False)
+            in_flight[future] = next_chunk
+            next_chunk += 1
+
+        done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+        for future in done:
+            results[in_flight.pop(future)] = future.result()
+
+    return [hashed for chunk in results for hashed in chunk]
+
+# Async variants for the async routes; they await the pool without holding a thread
+async def hash_password_async(password: str) -> str:
+    return await asyncio.wrap_future(submit_hashing(_hash, password))
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    valid, _ = await verify_and_update_password_async(plain_password, hashed_password)
+    return valid
+
+async def verify_and_update_password_async(plain_password: str, hashed_password: str) -> tuple[bool, Optional[str]]:
+    return await asyncio.wrap_future(submit_hashing(_verify_and_update, plain_password, hashed_password))
+
+async def hash_passwords_async(passwords: list[str]) -> list[str]:
+    return await asyncio.to_thread(hash_passwords, passwords)
\ No newline at end of file
@@ -1,10 +1,13 @@
-# top of module, before any requests calls
-from urllib3.contrib import pyopenssl
-pyopenssl.inject_into_urllib3()
-
 import os
+import time
 import logging
+import threading
+import httpx
 import requests
+from requests.adapters import HTTPAdapter
+from typing import Optional
+
+from core.metrics import sms_request_duration, sms_messages
 
 logger = logging.getLogger(__name__)
 
@@ -19,15 +22,97 @@ AT_BASE_URL = (
     else "https://api.sandbox.africastalking.com/version1/messaging"
 )
 
-# Core function
-def send_sms(phone_number: str, message: str) -> dict:
-    # Normalize phone number
+# Maximum recipients packed into one gateway request
+MAX_RECIPIENTS_PER_REQUEST = int(os.getenv("SMS_BATCH_MAX_RECIPIENTS", "100"))
+
+# HTTP client config
+POOL_SIZE = int(os.getenv("SMS_HTTP_POOL_SIZE", "10"))
+CONNECT_TIMEOUT = float(os.getenv("SMS_HTTP_CONNECT_TIMEOUT", "3"))
+READ_TIMEOUT = float(os.getenv("SMS_HTTP_READ_TIMEOUT", "10"))
+KEEPALIVE_EXPIRY = float(os.getenv("SMS_HTTP_KEEPALIVE_EXPIRY", "60"))
+
+# Circuit breaker config
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("SMS_BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_TIMEOUT = float(os.getenv("SMS_BREAKER_RESET_TIMEOUT", "30"))
+
+class CircuitOpenError(Exception):
+    pass
+
+# Fails fast after repeated gateway errors, then lets a single trial request
+# through once the reset timeout has passed.
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def before_call(self) -> None:
+        with self.lock:
+            state = self.state
+            if state == "closed":
+                return
+            if state == "half_open" and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return
+        raise CircuitOpenError("SMS gateway circuit is open")
+
+    def record_success(self) -> None:
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self.lock:
+            self.failures += 1
+            self.trial_in_flight = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                logger.warning("SMS gateway circuit opened after %s failures", self.failures)
+
+breaker = CircuitBreaker(BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_TIMEOUT)
+
+# Long-lived clients so each SMS reuses a pooled keep-alive connection
+http_session = requests.Session()
+http_session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE))
+
+async_client = httpx.AsyncClient(
+    timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+    limits=httpx.Limits(
+        max_connections=POOL_SIZE,
+        max_keepalive_connections=POOL_SIZE,
+        keepalive_expiry=KEEPALIVE_EXPIRY,
+    ),
+)
+
+async def close_clients() -> None:
+    http_session.close()
+    await async_client.aclose()
+
+def normalize_phone_number(phone_number: str) -> str:
     normalized = phone_number.strip()
     if not normalized.startswith("+"):
         if normalized.startswith("0"):
             normalized = f"+254{normalized[1:]}"
         elif normalized.startswith("254"):
             normalized = f"+{normalized}"
+    return normalized
+
+def build_request(phone_numbers: list[str], message: str) -> tuple[list[str], dict, dict]:
+    recipients = list(dict.fromkeys(normalize_phone_number(p) for p in phone_numbers))
+    if len(recipients) > MAX_RECIPIENTS_PER_REQUEST:
+        raise ValueError(f"At most {MAX_RECIPIENTS_PER_REQUEST} recipients per request")
 
     headers = {
         "apiKey": AT_API_KEY,
@@ -36,31 +121,126 @@ def send_sms(phone_number: str, message: str) -> dict:
     }
     data = {
         "username": AT_USERNAME,
-        "to": normalized,
+        "to": ",".join(recipients),
         "message": message,
     }
     if AT_SENDER_ID:
         data["from"] = AT_SENDER_ID
 
+    return recipients, headers, data
+
+# Per-recipient statusCode from the gateway. 100 Processed, 101 Sent and
+# 102 Queued mean the message was accepted. 5xx (InternalServerError,
+# GatewayError, RejectedByGateway) are on the gateway's side and worth
+# retrying. Anything else, like 403 InvalidPhoneNumber, 405 InsufficientBalance
+# or 406 UserInBlacklist, is rejected outright and will be again.
+ACCEPTED_STATUS_CODES = {100, 101, 102}
+
+def is_accepted(result: dict) -> bool:
+    return result.get("statusCode") in ACCEPTED_STATUS_CODES
+
+# Failures without a statusCode (HTTP errors, missing recipients) are retried
+def is_permanent_failure(result: dict) -> bool:
+    code = result.get("statusCode")
+    return code is not None and code not in ACCEPTED_STATUS_CODES and not 500 <= code < 600
+
+def status_code_of(entry: Optional[dict]) -> Optional[int]:
     try:
-        resp = requests.post(AT_BASE_URL, headers=headers, data=data, timeout=15)
-        logger.info("AT response: %s %s", resp.status_code, resp.text)
-
-        # Accept 200 or 201 as success
-        if resp.status_code not in (200, 201):
-            return {
-                "status": "failed",
-                "error": f"HTTP {resp.status_code}",
-                "raw": resp.text,
-            }
-
-        res = resp.json()
-        recipients = res.get("SMSMessageData", {}).get("Recipients", [])
-        return {
-            "status": recipients[0].get("status") if recipients else "failed",
-            "messageId": recipients[0].get("messageId") if recipients else None,
+        return int(entry["statusCode"])
+    except (TypeError, KeyError, ValueError):
+        return None
+
+def parse_response(recipients: list[str], status_code: int, text: str, json_body) -> dict[str, dict]:
+    logger.info("AT response: %s %s", status_code, text)
+
+    # Accept 200 or 201 as success
+    if status_code not in (200, 201):
+        failed = {
+            "status": "failed",
+            "statusCode": None,
+            "error": f"HTTP {status_code}",
+            "raw": text,
+        }
+        return {number: failed for number in recipients}
+
+    res = json_body()
+    entries = {
+        entry.get("number"): entry
+        for entry in res.get("SMSMessageData", {}).get("Recipients", [])
+    }
+    # A single recipient may come back in a different format than we sent it
+    if len(recipients) == 1 and len(entries) == 1:
+        entries = {recipients[0]: next(iter(entries.values()))}
+
+    results = {}
+    for number in recipients:
+        entry = entries.get(number)
+        results[number] = {
+            "status": entry.get("status") if entry else "failed",
+            "statusCode": status_code_of(entry),
+            "messageId": entry.get("messageId") if entry else None,
             "raw": res,
         }
+    return results
+
+# Latency by HTTP status class, and one count per recipient by the status the gateway gave it
+def record_request(started: float, outcome: str, results: Optional[dict[str, dict]] = None) -> None:
+    sms_request_duration.labels(outcome).observe(time.perf_counter() - started)
+    for result in (results or {}).values():
+        sms_messages.labels(result.get("status") or "unknown").inc()
+
+# Core function
+def send_sms(phone_number: str, message: str) -> dict:
+    normalized = normalize_phone_number(phone_number)
+    return send_bulk_sms([normalized], message)[normalized]
+
+# Send one message to several recipients in a single request.
+# Returns a result per normalized phone number, in the same shape as send_sms.
+def send_bulk_sms(phone_numbers: list[str], message: str) -> dict[str, dict]:
+    recipients, headers, data = build_request(phone_numbers, message)
+    breaker.before_call()
+
+    started = time.perf_counter()
+    try:
+        resp = http_session.post(
+            AT_BASE_URL, headers=headers, data=data, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)
+        )
     except Exception as e:
+        breaker.record_failure()
+        record_request(started, "error")
         logger.error("AT error: %s", e)
-        raise
\ No newline at end of file
+        raise
+
+    # Only gateway-side errors count against the breaker
+    if resp.status_code >= 500:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+    results = parse_response(recipients, resp.status_code, resp.text, resp.json)
+    record_request(started, f"{resp.status_code // 100}xx", results)
+    return results
+
+async def send_sms_async(phone_number: str, message: str) -> dict:
+    normalized = normalize_phone_number(phone_number)
+    return (await send_bulk_sms_async([normalized], message))[normalized]
+
+async def send_bulk_sms_async(phone_numbers: list[str], message: str) -> dict[str, dict]:
+    recipients, headers, data = build_request(phone_numbers, message)
+    breaker.before_call()
+
+    started = time.perf_counter()
+    try:
+        resp = await async_client.post(AT_BASE_URL, headers=headers, data=data)
+    except Exception as e:
+        breaker.record_failure()
+        record_request(started, "error")
+        logger.error("AT error: %s", e)
+        raise
+
+    if resp.status_code >= 500:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+    results = parse_response(recipients, resp.status_code, resp.text, resp.json)
+    record_request(started, f"{resp.status_code // 100}xx", results)
+    return results
@@ -0,0 +1,40 @@
+import os
+import time
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from core.database import QueryStats, request_queries
+
+SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING_ENABLED", "true").lower() == "true"
+
+def server_timing(stats: QueryStats, elapsed: float) -> str:
+    return f'db;dur={stats.total_time * 1000:.1f};desc="{stats.count} queries", app;dur={elapsed * 1000:.1f}'
+
+# Collects the queries of each request and reports their count and total
+# time in a Server-Timing header, which browser dev tools show next to the
+# request. A plain ASGI middleware, so the endpoint runs in the same context
+# and its queries land on this request's stats. Queries a streaming response
+# runs after the headers went out aren't included.
+class ServerTimingMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = QueryStats(scope["path"])
+        token = request_queries.set(stats)
+        started = time.perf_counter()
+
+        async def send_with_timing(message: Message) -> None:
+            if message["type"] == "http.response.start" and SERVER_TIMING_ENABLED:
+                headers = MutableHeaders(scope=message)
+                headers.append("Server-Timing", server_timing(stats, time.perf_counter() - started))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            request_queries.reset(token)
@@ -0,0 +1,138 @@
+import os
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+from sqlalchemy import insert
+from sqlmodel import Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from core.database import engine
+from collections import defaultdict
+from core.sending_sms import (
+    send_bulk_sms, normalize_phone_number, is_accepted, is_permanent_failure, CircuitOpenError,
+    MAX_RECIPIENTS_PER_REQUEST, BREAKER_RESET_TIMEOUT,
+)
+from models.sms_outbox_model import SmsOutbox, SmsStatus, EAT
+
+logger = logging.getLogger(__name__)
+
+# Config
+# The poll interval is also the window over which identical messages pile up into one batch
+POLL_INTERVAL = float(os.getenv("SMS_OUTBOX_POLL_INTERVAL", "2"))
+BATCH_SIZE = int(os.getenv("SMS_OUTBOX_BATCH_SIZE", "50"))
+MAX_ATTEMPTS = int(os.getenv("SMS_OUTBOX_MAX_ATTEMPTS", "5"))
+BACKOFF_BASE = float(os.getenv("SMS_OUTBOX_BACKOFF_BASE", "30"))
+BACKOFF_MAX = float(os.getenv("SMS_OUTBOX_BACKOFF_MAX", "3600"))
+# How long a claimed message stays hidden from other dispatchers before it is retried
+CLAIM_LEASE = float(os.getenv("SMS_OUTBOX_CLAIM_LEASE", "120"))
+DISPATCHER_ENABLED = os.getenv("SMS_OUTBOX_DISPATCHER_ENABLED", "true").lower() == "true"
+
+# Queue an SMS in the caller's session so it commits with the business change
+def queue_sms(session: Session, phone_number: str, message: str) -> SmsOutbox:
+    sms = SmsOutbox(phone_number=phone_number, message=message)
+    session.add(sms)
+    return sms
+
+# Queue many SMS with a single multi-row insert
+async def queue_sms_bulk(session: AsyncSession, messages: list[tuple[str, str]]) -> None:
+    if not messages:
+        return
+    rows = [SmsOutbox(phone_number=phone, message=text).model_dump() for phone, text in messages]
+    await session.execute(insert(SmsOutbox), rows)
+
+def backoff_delay(attempts: int) -> timedelta:
+    return timedelta(seconds=min(BACKOFF_BASE * (2 ** (attempts - 1)), BACKOFF_MAX))
+
+# Claim due messages, pushing their next attempt past the lease so a crashed
+# dispatcher doesn't lose them and a concurrent one doesn't pick them up.
+def claim_due_messages(session: Session, limit: int = BATCH_SIZE) -> list[SmsOutbox]:
+    now = datetime.now(EAT)
+    statement = (
+        select(SmsOutbox)
+        .where(SmsOutbox.status == SmsStatus.pending)
+        .where(SmsOutbox.next_attempt_at <= now)
+        .order_by(SmsOutbox.next_attempt_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    messages = session.exec(statement).all()
+
+    for sms in messages:
+        sms.attempts += 1
+        sms.next_attempt_at = now + timedelta(seconds=CLAIM_LEASE)
+
+    session.commit()
+    return list(messages)
+
+def record_result(sms: SmsOutbox, result: Optional[dict] = None, error: Optional[str] = None) -> None:
+    if result is not None and is_accepted(result):
+        sms.status = SmsStatus.sent
+        sms.message_id = result.get("messageId")
+        sms.last_error = None
+        return
+
+    if error is None:
+        error = str(result.get("error") or result.get("status")) if result else "unknown error"
+    sms.last_error = error[:255]
+
+    if sms.attempts >= MAX_ATTEMPTS or (result is not None and is_permanent_failure(result)):
+        sms.status = SmsStatus.failed
+    else:
+        sms.next_attempt_at = datetime.now(EAT) + backoff_delay(sms.attempts)
+
+# Group messages with identical text into multi-recipient requests
+def batch_by_message(messages: list[SmsOutbox]) -> list[list[SmsOutbox]]:
+    groups = defaultdict(list)
+    for sms in messages:
+        groups[sms.message].append(sms)
+
+    batches = []
+    for group in groups.values():
+        for i in range(0, len(group), MAX_RECIPIENTS_PER_REQUEST):
+            batches.append(group[i:i + MAX_RECIPIENTS_PER_REQUEST])
+    return batches
+
+# Send one batch of due messages. Returns the number of messages processed.
+def dispatch_pending(limit: int = BATCH_SIZE) -> int:
+    with Session(engine, expire_on_commit=False) as session:
+        messages = claim_due_messages(session, limit)
+
+        for batch in batch_by_message(messages):
+            try:
+                results = send_bulk_sms([sms.phone_number for sms in batch], batch[0].message)
+                for sms in batch:
+                    record_result(sms, result=results.get(normalize_phone_number(sms.phone_number)))
+            except CircuitOpenError:
+                # The gateway is known to be down, don't burn an attempt on it
+                for sms in batch:
+                    sms.attempts -= 1
+                    sms.next_attempt_at = datetime.now(EAT) + timedelta(seconds=BREAKER_RESET_TIMEOUT)
+            except Exception as e:
+                for sms in batch:
+                    record_result(sms, error=str(e))
+            session.add_all(batch)
+            session.commit()
+
+    return len(messages)
+
+async def run_dispatcher(stop_event: asyncio.Event) -> None:
+    while not stop_event.is_set():
+        try:
+            processed = await asyncio.to_thread(dispatch_pending)
+        except Exception as e:
+            logger.error("SMS outbox dispatch failed: %s", e)
+            processed = 0
+
+        # Drain a backlog without waiting, otherwise sleep until the next poll
+        if processed >= BATCH_SIZE:
+            continue
+        try:
+            await asyncio.wait_for(stop_event.wait(), timeout=POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+# Run the dispatcher as its own process: python -m core.sms_outbox
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run_dispatcher(asyncio.Event()))
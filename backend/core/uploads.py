@@ -0,0 +1,212 @@
+import os
+import uuid
+import asyncio
+import hashlib
+import mimetypes
+import aiofiles
+import aiofiles.os
+from collections import Counter
+from typing import NamedTuple, Optional
+from fastapi import HTTPException, UploadFile
+from sqlalchemy import case, update
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from models.client_model import Guarantor_business_photos, PhotoBlob
+
+# Bytes read from an upload and written to disk at a time
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(64 * 1024)))
+
+class StoredUpload(NamedTuple):
+    path: str
+    content_hash: str
+    size: int
+    # False when identical bytes were already on disk and this upload was dropped
+    created: bool
+    # This upload's own copy of bytes that were already on disk. Kept until the
+    # blob reference is taken, in case a concurrent delete removes the
+    # existing file first; see acquire_blobs.
+    temp_path: Optional[str] = None
+
+async def remove_quietly(path: str) -> None:
+    try:
+        await aiofiles.os.remove(path)
+    except FileNotFoundError:
+        pass
+
+# Files are stored under their SHA-256, fanned out over subdirectories by the
+# first two hex digits, so identical bytes always land on the same path.
+def content_path(directory: str, content_hash: str, file_ext: str) -> str:
+    return os.path.join(directory, content_hash[:2], f"{content_hash}{file_ext}")
+
+# Streams an upload to disk in fixed-size chunks, hashing as it goes, so memory
+# stays flat no matter how big the file is. The size limit is enforced on the
+# bytes actually received, not on what the client claims. Starlette has
+# already spooled the multipart body by now, so the request as a whole is
+# capped earlier by core.body_limit. The file is written
+# under a temp name and renamed to its content address once complete, so a
+# partial file is never visible under its final name.
+async def save_upload(file: UploadFile, directory: str, max_size: int) -> StoredUpload:
+    temp_path = os.path.join(directory, f".{uuid.uuid4()}.part")
+    digest = hashlib.sha256()
+
+    size = 0
+    try:
+        async with aiofiles.open(temp_path, "wb") as f:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if size > max_size:
+                    raise HTTPException(413, "File too large")
+                digest.update(chunk)
+                await f.write(chunk)
+
+        content_hash = digest.hexdigest()
+        file_ext = mimetypes.guess_extension(file.content_type or "") or os.path.splitext(file.filename or "")[1]
+        file_path = content_path(directory, content_hash, file_ext)
+
+        # Same bytes already stored, keep the existing copy. Touching it
+        # restarts the garbage collector's grace period for the file, which
+        # discard_photo_files honours too.
+        try:
+            await asyncio.to_thread(os.utime, file_path)
+            return StoredUpload(file_path, content_hash, size, False, temp_path)
+        except FileNotFoundError:
+            pass
+
+        await aiofiles.os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        await aiofiles.os.replace(temp_path, file_path)
+    except BaseException:
+        await remove_quietly(temp_path)
+        raise
+    finally:
+        await file.close()
+
+    return StoredUpload(file_path, content_hash, size, True)
+
+# Saves all files of one request concurrently. If any of them fails, the
+# files this request created are removed and the first error is raised.
+async def save_uploads(files: list[UploadFile], directory: str, max_size: int) -> list[StoredUpload]:
+    await aiofiles.os.makedirs(directory, exist_ok=True)
+    results = await asyncio.gather(
+        *(save_upload(file, directory, max_size) for file in files),
+        return_exceptions=True,
+    )
+
+    errors = [result for result in results if isinstance(result, BaseException)]
+    if errors:
+        await remove_created([result for result in results if isinstance(result, StoredUpload)])
+        raise errors[0]
+    return results
+
+async def remove_files(paths: list[str]) -> None:
+    await asyncio.gather(*(remove_quietly(path) for path in paths))
+
+# Undo a failed upload without touching blobs that were already stored
+async def remove_created(uploads: list[StoredUpload]) -> None:
+    await remove_files([upload.path for upload in uploads if upload.created])
+    await remove_temp_copies(uploads)
+
+async def remove_temp_copies(uploads: list[StoredUpload]) -> None:
+    await remove_files([upload.temp_path for upload in uploads if upload.temp_path])
+
+# A new blob row for bytes that save_upload found on disk means the old blob
+# was released and deleted in between, and its file may be gone with it.
+# The upload's own copy is put back in its place.
+async def restore_file(upload: StoredUpload) -> None:
+    if upload.temp_path:
+        await aiofiles.os.makedirs(os.path.dirname(upload.path), exist_ok=True)
+        await aiofiles.os.replace(upload.temp_path, upload.path)
+
+# Take one reference per upload on its blob, creating blobs seen for the
+# first time. The increment is a single UPDATE, so concurrent uploads of the
+# same bytes can't lose a count. Existing blobs are locked and bumped
+# together and new ones inserted together, so a request costs the same few
+# statements however many distinct files it carries. Once a reference is
+# held the blob can't be deleted, so the temp copies are dropped at the end.
+async def acquire_blobs(session: AsyncSession, uploads: list[StoredUpload]) -> None:
+    await take_references(session, uploads)
+    await remove_temp_copies(uploads)
+
+async def take_references(session: AsyncSession, uploads: list[StoredUpload]) -> None:
+    first_upload = {}
+    for upload in uploads:
+        first_upload.setdefault(upload.content_hash, upload)
+    counts = Counter(upload.content_hash for upload in uploads)
+
+    existing = set((await session.exec(
+        select(PhotoBlob.content_hash).where(PhotoBlob.content_hash.in_(counts)).with_for_update()
+    )).all())
+    if existing:
+        await session.execute(
+            update(PhotoBlob)
+            .where(PhotoBlob.content_hash.in_(existing))
+            .values(ref_count=PhotoBlob.ref_count + case(
+                {content_hash: counts[content_hash] for content_hash in existing}, value=PhotoBlob.content_hash,
+            ))
+        )
+
+    new_hashes = [content_hash for content_hash in counts if content_hash not in existing]
+    if not new_hashes:
+        return
+    try:
+        async with session.begin_nested():
+            session.add_all([
+                PhotoBlob(
+                    content_hash=content_hash, path=first_upload[content_hash].path,
+                    size=first_upload[content_hash].size, ref_count=counts[content_hash],
+                )
+                for content_hash in new_hashes
+            ])
+    except IntegrityError:
+        # Another request created some of them in the meantime
+        for content_hash in new_hashes:
+            await acquire_blob(session, first_upload[content_hash], counts[content_hash])
+        return
+    for content_hash in new_hashes:
+        await restore_file(first_upload[content_hash])
+
+async def acquire_blob(session: AsyncSession, upload: StoredUpload, count: int) -> None:
+    increment = (
+        update(PhotoBlob)
+        .where(PhotoBlob.content_hash == upload.content_hash)
+        .values(ref_count=PhotoBlob.ref_count + count)
+    )
+    if (await session.execute(increment)).rowcount:
+        return
+    try:
+        async with session.begin_nested():
+            session.add(PhotoBlob(
+                content_hash=upload.content_hash, path=upload.path, size=upload.size, ref_count=count,
+            ))
+    except IntegrityError:
+        await session.execute(increment)
+        return
+    await restore_file(upload)
+
+class ReleasedPhoto(NamedTuple):
+    content_hash: Optional[str]
+    link: str
+    display_link: Optional[str]
+    thumbnail_link: Optional[str]
+    guarantor_id: str
+
+# Drop the references held by the photo rows matching the conditions. Must
+# run before those rows are deleted. Blobs left at zero are garbage. Returns
+# the released photos so their files can be cleaned up after the commit.
+# All blobs are decremented in one UPDATE, however many distinct files there are.
+async def release_blobs(session: AsyncSession, *conditions) -> list[ReleasedPhoto]:
+    Photo = Guarantor_business_photos
+    released = [ReleasedPhoto(*row) for row in (await session.exec(
+        select(Photo.content_hash, Photo.link, Photo.display_link, Photo.thumbnail_link, Photo.guarantor_id)
+        .where(*conditions)
+    )).all()]
+
+    counts = Counter(photo.content_hash for photo in released if photo.content_hash)
+    if counts:
+        await session.execute(
+            update(PhotoBlob)
+            .where(PhotoBlob.content_hash.in_(counts))
+            .values(ref_count=PhotoBlob.ref_count - case(counts, value=PhotoBlob.content_hash))
+        )
+    return released
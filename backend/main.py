@@ -1,17 +1,56 @@
+import os
+import asyncio
 from fastapi import FastAPI
 from contextlib import asynccontextmanager
 from core.database import create_db_and_tables
-from routes import client, guarantor, test, sms, employee
+from core.sms_outbox import run_dispatcher, DISPATCHER_ENABLED
+from core.sending_sms import close_clients
+from core.security import shutdown_hash_executor
+from core.image_processing import run_image_processor, shutdown_image_executor, PROCESSOR_ENABLED
+from core.photo_serving import PhotoFiles, UPLOAD_DIR, PHOTO_URL_PREFIX
+from core.photo_gc import run_photo_gc, GC_ENABLED
+from core.server_timing import ServerTimingMiddleware
+from core.metrics import MetricsMiddleware
+from core.body_limit import BodySizeLimitMiddleware
+from routes import client, guarantor, test, sms, employee, status, metrics
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     create_db_and_tables()
+
+    # Drain the SMS outbox in the background so writes never wait on the gateway
+    stop_event = asyncio.Event()
+    dispatcher = asyncio.create_task(run_dispatcher(stop_event)) if DISPATCHER_ENABLED else None
+    # Re-encode and thumbnail uploaded photos off the request path
+    processor = asyncio.create_task(run_image_processor(stop_event)) if PROCESSOR_ENABLED else None
+    # Sweep photo files no row points at any more
+    photo_gc = asyncio.create_task(run_photo_gc(stop_event)) if GC_ENABLED else None
     yield
+    stop_event.set()
+    for task in (dispatcher, processor, photo_gc):
+        if task:
+            await task
+    await close_clients()
+    shutdown_hash_executor()
+    shutdown_image_executor()
 
 app = FastAPI(title="Loan management system", lifespan=lifespan)
 
+# Query count and database time per request, in the Server-Timing header
+app.add_middleware(ServerTimingMiddleware)
+# Latency, in-flight requests and threadpool use for /metrics
+app.add_middleware(MetricsMiddleware)
+# Refuses oversized uploads before their body is parsed
+app.add_middleware(BodySizeLimitMiddleware)
+
 app.include_router(test.router)
+app.include_router(status.router)
+app.include_router(metrics.router)
 app.include_router(sms.router)
 app.include_router(client.router)
 app.include_router(employee.router)
-app.include_router(guarantor.router)
\ No newline at end of file
+app.include_router(guarantor.router)
+
+# Uploaded guarantor photos, served with long-lived caching and range support
+os.makedirs(UPLOAD_DIR, exist_ok=True)
+app.mount(PHOTO_URL_PREFIX, PhotoFiles(directory=UPLOAD_DIR), name="photos")
\ No newline at end of file
@@ -0,0 +1,33 @@
+"""Indexed created_at for pagination
+
+Revision ID: 3f9d2b7c6a18
+Revises: 8c41e7a2f5d3
+Create Date: 2026-10-17 11:04:52.310647
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f9d2b7c6a18'
+down_revision: Union[str, Sequence[str], None] = '8c41e7a2f5d3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index(op.f('ix_client_created_at'), 'client', ['created_at'], unique=False)
+    op.create_index(op.f('ix_guarantor_created_at'), 'guarantor', ['created_at'], unique=False)
+    op.create_index(op.f('ix_employee_created_at'), 'employee', ['created_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_employee_created_at'), table_name='employee')
+    op.drop_index(op.f('ix_guarantor_created_at'), table_name='guarantor')
+    op.drop_index(op.f('ix_client_created_at'), table_name='client')
@@ -0,0 +1,119 @@
+"""Stored ids as binary uuids
+
+Revision ID: 4c8e2f6a9d31
+Revises: e81f4b6d2a57
+Create Date: 2026-10-17 23:12:05.361842
+
+"""
+import uuid
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+from sqlalchemy.dialects import mysql, postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4c8e2f6a9d31'
+down_revision: Union[str, Sequence[str], None] = 'e81f4b6d2a57'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+ID_COLUMNS = [
+    ('client', 'client_id'),
+    ('guarantor', 'guarantor_id'),
+    ('guarantor', 'client_id'),
+    ('guarantor_business_photos', 'image_id'),
+    ('guarantor_business_photos', 'guarantor_id'),
+    ('employee', 'employee_id'),
+    ('refreshtoken', 'id'),
+    ('sms_outbox', 'id'),
+]
+
+FOREIGN_KEYS = [
+    ('guarantor', 'client_id', 'client', 'client_id'),
+    ('guarantor_business_photos', 'guarantor_id', 'guarantor', 'guarantor_id'),
+]
+
+# Plain indexes that duplicated the primary key
+PRIMARY_KEY_INDEXES = [
+    ('client', 'client_id'),
+    ('guarantor', 'guarantor_id'),
+    ('guarantor_business_photos', 'image_id'),
+    ('employee', 'employee_id'),
+]
+
+naming_convention = {"fk": "fk_%(table_name)s_%(column_0_name)s"}
+
+# MySQL wants the child and parent column types to match, so the foreign keys
+# are dropped while the ids are converted and put back afterwards
+def drop_foreign_keys() -> None:
+    for table, column, _, _ in FOREIGN_KEYS:
+        foreign_keys = sa.inspect(op.get_bind()).get_foreign_keys(table)
+        existing = next(fk for fk in foreign_keys if fk['constrained_columns'] == [column])
+        with op.batch_alter_table(table, naming_convention=naming_convention) as batch_op:
+            batch_op.drop_constraint(existing['name'] or f'fk_{table}_{column}', type_='foreignkey')
+
+def create_foreign_keys() -> None:
+    for table, column, referent, remote_column in FOREIGN_KEYS:
+        with op.batch_alter_table(table, naming_convention=naming_convention) as batch_op:
+            batch_op.create_foreign_key(f'fk_{table}_{column}', referent, [column], [remote_column], ondelete='CASCADE')
+
+# Row by row, for SQLite, which has no functions to do it in SQL
+def convert_rows(table: str, column: str, convert) -> None:
+    bind = op.get_bind()
+    target = sa.table(table, sa.column(column))
+    for (value,) in bind.execute(sa.select(target.c[column])).all():
+        bind.execute(target.update().where(target.c[column] == value).values({column: convert(value)}))
+
+def to_binary(table: str, column: str, dialect: str) -> None:
+    if dialect == 'mysql':
+        # Strip the dashes, reinterpret the hex text as bytes, then decode it
+        op.execute(f"UPDATE {table} SET {column} = REPLACE({column}, '-', '')")
+        op.alter_column(table, column, type_=mysql.VARBINARY(32), existing_type=sqlmodel.sql.sqltypes.AutoString(), existing_nullable=False)
+        op.execute(f"UPDATE {table} SET {column} = UNHEX({column})")
+        op.alter_column(table, column, type_=mysql.BINARY(16), existing_type=mysql.VARBINARY(32), existing_nullable=False)
+    elif dialect == 'postgresql':
+        op.alter_column(table, column, type_=postgresql.UUID(as_uuid=False), existing_type=sqlmodel.sql.sqltypes.AutoString(), existing_nullable=False, postgresql_using=f'{column}::uuid')
+    else:
+        # Converted before the table is rebuilt, since casting text to BLOB keeps the text
+        convert_rows(table, column, lambda value: uuid.UUID(value).bytes)
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.alter_column(column, type_=sa.LargeBinary(16), existing_type=sqlmodel.sql.sqltypes.AutoString(), existing_nullable=False)
+
+def to_string(table: str, column: str, dialect: str) -> None:
+    if dialect == 'mysql':
+        op.alter_column(table, column, type_=mysql.VARBINARY(36), existing_type=mysql.BINARY(16), existing_nullable=False)
+        op.execute(
+            f"UPDATE {table} SET {column} = LOWER(INSERT(INSERT(INSERT(INSERT(HEX({column}), 9, 0, '-'), 14, 0, '-'), 19, 0, '-'), 24, 0, '-'))"
+        )
+        op.alter_column(table, column, type_=sqlmodel.sql.sqltypes.AutoString(), existing_type=mysql.VARBINARY(36), existing_nullable=False)
+    elif dialect == 'postgresql':
+        op.alter_column(table, column, type_=sqlmodel.sql.sqltypes.AutoString(), existing_type=postgresql.UUID(as_uuid=False), existing_nullable=False, postgresql_using=f'{column}::text')
+    else:
+        convert_rows(table, column, lambda value: str(uuid.UUID(bytes=bytes(value))))
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.alter_column(column, type_=sqlmodel.sql.sqltypes.AutoString(), existing_type=sa.LargeBinary(16), existing_nullable=False)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    dialect = op.get_bind().dialect.name
+    for table, column in PRIMARY_KEY_INDEXES:
+        op.drop_index(op.f(f'ix_{table}_{column}'), table_name=table)
+    drop_foreign_keys()
+    for table, column in ID_COLUMNS:
+        to_binary(table, column, dialect)
+    create_foreign_keys()
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    dialect = op.get_bind().dialect.name
+    drop_foreign_keys()
+    for table, column in ID_COLUMNS:
+        to_string(table, column, dialect)
+    create_foreign_keys()
+    for table, column in PRIMARY_KEY_INDEXES:
+        op.create_index(op.f(f'ix_{table}_{column}'), table, [column], unique=False)
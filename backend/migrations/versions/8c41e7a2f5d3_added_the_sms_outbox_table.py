@@ -0,0 +1,45 @@
+"""Added the sms outbox table
+
+Revision ID: 8c41e7a2f5d3
+Revises: d2b63fa34de5
+Create Date: 2026-10-17 09:12:31.524117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8c41e7a2f5d3'
+down_revision: Union[str, Sequence[str], None] = 'd2b63fa34de5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('sms_outbox',
+    sa.Column('id', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('phone_number', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('message', sa.Text(), nullable=False),
+    sa.Column('status', sa.Enum('pending', 'sent', 'failed', name='smsstatus'), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('next_attempt_at', sa.DateTime(), nullable=False),
+    sa.Column('last_error', sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+    sa.Column('message_id', sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_sms_outbox_status'), 'sms_outbox', ['status'], unique=False)
+    op.create_index(op.f('ix_sms_outbox_next_attempt_at'), 'sms_outbox', ['next_attempt_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_sms_outbox_next_attempt_at'), table_name='sms_outbox')
+    op.drop_index(op.f('ix_sms_outbox_status'), table_name='sms_outbox')
+    op.drop_table('sms_outbox')
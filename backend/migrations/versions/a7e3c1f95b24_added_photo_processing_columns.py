@@ -0,0 +1,40 @@
+"""Added photo processing columns
+
+Revision ID: a7e3c1f95b24
+Revises: 3f9d2b7c6a18
+Create Date: 2026-10-17 18:12:40.518302
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a7e3c1f95b24'
+down_revision: Union[str, Sequence[str], None] = '3f9d2b7c6a18'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Existing photos start out pending so the processor backfills them
+    op.add_column('guarantor_business_photos', sa.Column('display_link', sqlmodel.sql.sqltypes.AutoString(), nullable=True))
+    op.add_column('guarantor_business_photos', sa.Column('thumbnail_link', sqlmodel.sql.sqltypes.AutoString(), nullable=True))
+    op.add_column('guarantor_business_photos', sa.Column('processing_status', sa.Enum('pending', 'ready', 'failed', name='photostatus'), nullable=False, server_default='pending'))
+    op.add_column('guarantor_business_photos', sa.Column('processing_attempts', sa.Integer(), nullable=False, server_default='0'))
+    op.add_column('guarantor_business_photos', sa.Column('processing_claimed_until', sa.DateTime(), nullable=True))
+    op.create_index(op.f('ix_guarantor_business_photos_processing_status'), 'guarantor_business_photos', ['processing_status'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_guarantor_business_photos_processing_status'), table_name='guarantor_business_photos')
+    op.drop_column('guarantor_business_photos', 'processing_claimed_until')
+    op.drop_column('guarantor_business_photos', 'processing_attempts')
+    op.drop_column('guarantor_business_photos', 'processing_status')
+    op.drop_column('guarantor_business_photos', 'thumbnail_link')
+    op.drop_column('guarantor_business_photos', 'display_link')
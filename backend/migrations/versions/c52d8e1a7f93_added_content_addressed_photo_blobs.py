@@ -0,0 +1,48 @@
+"""Added content addressed photo blobs
+
+Revision ID: c52d8e1a7f93
+Revises: a7e3c1f95b24
+Create Date: 2026-10-17 19:03:17.884215
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c52d8e1a7f93'
+down_revision: Union[str, Sequence[str], None] = 'a7e3c1f95b24'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('photo_blob',
+    sa.Column('content_hash', sqlmodel.sql.sqltypes.AutoString(length=64), nullable=False),
+    sa.Column('path', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('size', sa.Integer(), nullable=False),
+    sa.Column('ref_count', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('content_hash')
+    )
+    op.create_index(op.f('ix_photo_blob_ref_count'), 'photo_blob', ['ref_count'], unique=False)
+    # Existing photos keep their uuid named files and stay outside the blob store
+    with op.batch_alter_table('guarantor_business_photos') as batch_op:
+        batch_op.add_column(sa.Column('content_hash', sqlmodel.sql.sqltypes.AutoString(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_guarantor_business_photos_content_hash'), ['content_hash'], unique=False)
+        batch_op.create_foreign_key('fk_guarantor_business_photos_content_hash', 'photo_blob', ['content_hash'], ['content_hash'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('guarantor_business_photos') as batch_op:
+        batch_op.drop_constraint('fk_guarantor_business_photos_content_hash', type_='foreignkey')
+        batch_op.drop_index(batch_op.f('ix_guarantor_business_photos_content_hash'))
+        batch_op.drop_column('content_hash')
+    op.drop_index(op.f('ix_photo_blob_ref_count'), table_name='photo_blob')
+    op.drop_table('photo_blob')
@@ -0,0 +1,45 @@
+"""Cascaded guarantor and photo deletes
+
+Revision ID: e81f4b6d2a57
+Revises: c52d8e1a7f93
+Create Date: 2026-10-17 21:06:44.127390
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e81f4b6d2a57'
+down_revision: Union[str, Sequence[str], None] = 'c52d8e1a7f93'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# The original constraints were created without names, so the database picked
+# one (guarantor_ibfk_1 on MySQL). Look it up instead of guessing, and give
+# unnamed SQLite constraints a name the batch rebuild can refer to.
+naming_convention = {"fk": "fk_%(table_name)s_%(column_0_name)s"}
+
+def replace_foreign_key(table: str, column: str, referent: str, remote_column: str, ondelete=None) -> None:
+    foreign_keys = sa.inspect(op.get_bind()).get_foreign_keys(table)
+    existing = next(fk for fk in foreign_keys if fk['constrained_columns'] == [column])
+    name = f'fk_{table}_{column}'
+
+    with op.batch_alter_table(table, naming_convention=naming_convention) as batch_op:
+        batch_op.drop_constraint(existing['name'] or name, type_='foreignkey')
+        batch_op.create_foreign_key(name, referent, [column], [remote_column], ondelete=ondelete)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    replace_foreign_key('guarantor', 'client_id', 'client', 'client_id', ondelete='CASCADE')
+    replace_foreign_key('guarantor_business_photos', 'guarantor_id', 'guarantor', 'guarantor_id', ondelete='CASCADE')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    replace_foreign_key('guarantor_business_photos', 'guarantor_id', 'guarantor', 'guarantor_id')
+    replace_foreign_key('guarantor', 'client_id', 'client', 'client_id')
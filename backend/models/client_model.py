@@ -1,18 +1,23 @@
 from sqlmodel import SQLModel, Field, Relationship
-from uuid import uuid4
-from datetime import datetime, timezone, timedelta, date
+from sqlalchemy import DateTime
+from models.ids import BinaryUUID, new_id
+from models.timestamps import EAT, stored_now
+from datetime import datetime, date
 from enum import Enum
 from typing import Optional, List
 
-EAT = timezone(timedelta(hours=3))
-
 class MaritalStatus(str, Enum):
     married = "married"
     single = "single"
     widowed = "widowed"
 
+class PhotoStatus(str, Enum):
+    pending = "pending"
+    ready = "ready"
+    failed = "failed"
+
 class Client(SQLModel, table=True):
-    client_id: str = Field(default_factory=lambda: str(uuid4()), primary_key=True, index=True)
+    client_id: str = Field(default_factory=new_id, primary_key=True, sa_type=BinaryUUID)
     client_name: str
     national_id_number: str = Field(unique=True, index=True)
     client_phone_number: str = Field(index=True, unique=True)
@@ -24,38 +29,66 @@ class Client(SQLModel, table=True):
     next_of_kin_contact: str
     marital_status: MaritalStatus
     number_of_children: int
-    created_at: datetime = Field(default_factory=lambda: datetime.now(EAT))
+    created_at: datetime = Field(default_factory=stored_now, sa_type=DateTime, index=True)
     updated_at: Optional[datetime] = Field(
-        default_factory=lambda: datetime.now(EAT),
-        sa_column_kwargs={"onupdate": lambda: datetime.now(EAT)},
+        default_factory=stored_now,
+        sa_type=DateTime,
+        sa_column_kwargs={"onupdate": stored_now},
     )
 
-    guarantors: List["Guarantor"] = Relationship(back_populates="client", sa_relationship_kwargs={"cascade": "delete"})   # A client can have multiple guarantors
+    # The database cascades deletes, so dependents are never loaded just to be deleted
+    guarantors: List["Guarantor"] = Relationship(back_populates="client", sa_relationship_kwargs={"cascade": "delete", "passive_deletes": True})   # A client can have multiple guarantors
 
 class Guarantor(SQLModel, table=True):
-    guarantor_id: str = Field(default_factory=lambda: str(uuid4()), primary_key=True, index=True)
-    client_id: str = Field(foreign_key="client.client_id")
+    guarantor_id: str = Field(default_factory=new_id, primary_key=True, sa_type=BinaryUUID)
+    client_id: str = Field(foreign_key="client.client_id", ondelete="CASCADE", sa_type=BinaryUUID)
     guarantor_name: str
     national_id_number: str = Field(unique=True, index=True)
     guarantor_phone_number: str = Field(index=True, unique=True)
     guarantor_business_name: str
     guarantor_business_location: str
-    created_at: datetime = Field(default_factory=lambda: datetime.now(EAT))
+    created_at: datetime = Field(default_factory=stored_now, sa_type=DateTime, index=True)
     updated_at: Optional[datetime] = Field(
-        default_factory=lambda: datetime.now(EAT),
-        sa_column_kwargs={"onupdate": lambda: datetime.now(EAT)},
+        default_factory=stored_now,
+        sa_type=DateTime,
+        sa_column_kwargs={"onupdate": stored_now},
     )
 
     client: Client = Relationship(back_populates="guarantors")  # A guarantor can only have one client 
-    guarantor_business_photos: List["Guarantor_business_photos"] = Relationship(back_populates="guarantor", sa_relationship_kwargs={"cascade": "delete"})
+    guarantor_business_photos: List["Guarantor_business_photos"] = Relationship(back_populates="guarantor", sa_relationship_kwargs={"cascade": "delete", "passive_deletes": True})
 
 class Guarantor_business_photos(SQLModel, table=True):
-    image_id: str = Field(default_factory=lambda: str(uuid4()), primary_key=True, index=True)
-    guarantor_id: str = Field(foreign_key="guarantor.guarantor_id")
+    image_id: str = Field(default_factory=new_id, primary_key=True, sa_type=BinaryUUID)
+    guarantor_id: str = Field(foreign_key="guarantor.guarantor_id", ondelete="CASCADE", sa_type=BinaryUUID)
     link: str
-    created_at: datetime = Field(default_factory=lambda: datetime.now(EAT))
+    # Photos uploaded before content-addressed storage have no blob
+    content_hash: Optional[str] = Field(default=None, foreign_key="photo_blob.content_hash", index=True)
+    # Filled in by the background image processor
+    display_link: Optional[str] = None
+    thumbnail_link: Optional[str] = None
+    processing_status: PhotoStatus = Field(default=PhotoStatus.pending, index=True)
+    processing_attempts: int = Field(default=0)
+    processing_claimed_until: Optional[datetime] = None
+    created_at: datetime = Field(default_factory=stored_now, sa_type=DateTime)
     updated_at: Optional[datetime] = Field(
-        default_factory=lambda: datetime.now(EAT),
-        sa_column_kwargs={"onupdate": lambda: datetime.now(EAT)},
+        default_factory=stored_now,
+        sa_type=DateTime,
+        sa_column_kwargs={"onupdate": stored_now},
     )
-    guarantor: Guarantor = Relationship(back_populates="guarantor_business_photos")
\ No newline at end of file
+    guarantor: Guarantor = Relationship(back_populates="guarantor_business_photos")
+
+# One stored file, shared by every photo row with the same bytes
+class PhotoBlob(SQLModel, table=True):
+    __tablename__ = "photo_blob"
+
+    content_hash: str = Field(primary_key=True, max_length=64)    # SHA-256 hex digest
+    path: str
+    size: int
+    # Number of photo rows pointing at this blob; zero means it can be collected
+    ref_count: int = Field(default=0, index=True)
+    created_at: datetime = Field(default_factory=stored_now, sa_type=DateTime)
+    updated_at: Optional[datetime] = Field(
+        default_factory=stored_now,
+        sa_type=DateTime,
+        sa_column_kwargs={"onupdate": stored_now},
+    )
\ No newline at end of file
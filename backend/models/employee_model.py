@@ -1,24 +1,25 @@
 from sqlmodel import SQLModel, Field
-from datetime import datetime, timezone, timedelta
-from uuid import uuid4
+from datetime import datetime
+from sqlalchemy import DateTime
+from models.ids import BinaryUUID, new_id
+from models.timestamps import stored_now
 from typing import Optional
 from enum import Enum
 
-EAT = timezone(timedelta(hours=3))
-
 class Employee_type(str, Enum):
 	admin = "admin"
 	regular = "regular"
 
 class Employee(SQLModel, table=True):
-	employee_id: str = Field(default_factory=lambda: str(uuid4()), primary_key=True, index=True)
+	employee_id: str = Field(default_factory=new_id, primary_key=True, sa_type=BinaryUUID)
 	employee_name: str
 	employee_phone_number: str = Field(index=True, unique=True)
 	employee_type: Employee_type
 	password_hash: str
 
-	created_at: datetime = Field(default_factory=lambda: datetime.now(EAT))
+	created_at: datetime = Field(default_factory=stored_now, sa_type=DateTime, index=True)
 	updated_at: Optional[datetime] = Field(
-		default_factory=lambda: datetime.now(EAT),
-		sa_column_kwargs={"onupdate": lambda: datetime.now(EAT)},
+		default_factory=stored_now,
+		sa_type=DateTime,
+		sa_column_kwargs={"onupdate": stored_now},
 		)
\ No newline at end of file
@@ -0,0 +1,55 @@
+import os
+import time
+import uuid
+from sqlalchemy import LargeBinary
+from sqlalchemy.dialects import mysql, postgresql
+from sqlalchemy.types import TypeDecorator
+
+# UUIDv7 (RFC 9562): a 48-bit millisecond timestamp followed by random bits.
+# New rows land at the end of the primary key index instead of on a random
+# page, so inserts don't split pages all over the clustered index.
+def uuid7() -> uuid.UUID:
+    timestamp_ms = time.time_ns() // 1_000_000
+    rand = int.from_bytes(os.urandom(10), "big")
+    value = (timestamp_ms & 0xFFFF_FFFF_FFFF) << 80
+    value |= 0x7 << 76                          # version
+    value |= ((rand >> 62) & 0xFFF) << 64       # rand_a
+    value |= 0b10 << 62                         # variant
+    value |= rand & 0x3FFF_FFFF_FFFF_FFFF       # rand_b
+    return uuid.UUID(int=value)
+
+def new_id() -> str:
+    return str(uuid7())
+
+# Ids stay canonical UUID strings in Python and the API, and are stored as
+# 16 bytes: BINARY(16) on MySQL, BLOB on SQLite and the native uuid type on
+# PostgreSQL. The bytes sort in the same order as the strings, so keyset
+# pagination on (created_at, id) is unchanged.
+class BinaryUUID(TypeDecorator):
+    impl = LargeBinary(16)
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == "mysql":
+            return dialect.type_descriptor(mysql.BINARY(16))
+        if dialect.name == "postgresql":
+            return dialect.type_descriptor(postgresql.UUID(as_uuid=False))
+        return dialect.type_descriptor(LargeBinary(16))
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        try:
+            parsed = value if isinstance(value, uuid.UUID) else uuid.UUID(str(value))
+        except ValueError:
+            # Something that isn't a UUID can't match any row, so a lookup by
+            # a malformed id finds nothing instead of failing
+            return None
+        return str(parsed) if dialect.name == "postgresql" else parsed.bytes
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            return str(uuid.UUID(bytes=bytes(value)))
+        return str(value)
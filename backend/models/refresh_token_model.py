@@ -1,13 +1,13 @@
-import uuid
 from sqlmodel import SQLModel, Field
-from datetime import datetime, timezone, timedelta
-
-EAT = timezone(timedelta(hours=3))
+from sqlalchemy import DateTime
+from models.ids import BinaryUUID, new_id
+from models.timestamps import stored_now
+from datetime import datetime
 
 class RefreshToken(SQLModel, table=True):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()), primary_key=True)
+    id: str = Field(default_factory=new_id, primary_key=True, sa_type=BinaryUUID)
     user_id: str = Field(index=True)
     token: str = Field(unique=True, index=True)
     expires_at: datetime
-    created_at: datetime = Field(default_factory=lambda: datetime.now(EAT))
+    created_at: datetime = Field(default_factory=stored_now, sa_type=DateTime)
     revoked: bool = Field(default=False)
\ No newline at end of file
@@ -0,0 +1,30 @@
+from sqlmodel import SQLModel, Field
+from sqlalchemy import DateTime, Text
+from models.ids import BinaryUUID, new_id
+from models.timestamps import EAT, stored_now
+from datetime import datetime
+from enum import Enum
+from typing import Optional
+
+class SmsStatus(str, Enum):
+    pending = "pending"
+    sent = "sent"
+    failed = "failed"
+
+class SmsOutbox(SQLModel, table=True):
+    __tablename__ = "sms_outbox"
+
+    id: str = Field(default_factory=new_id, primary_key=True, sa_type=BinaryUUID)
+    phone_number: str
+    message: str = Field(sa_type=Text)
+    status: SmsStatus = Field(default=SmsStatus.pending, index=True)
+    attempts: int = Field(default=0)
+    next_attempt_at: datetime = Field(default_factory=lambda: datetime.now(EAT), index=True)
+    last_error: Optional[str] = None
+    message_id: Optional[str] = None
+    created_at: datetime = Field(default_factory=stored_now, sa_type=DateTime)
+    updated_at: Optional[datetime] = Field(
+        default_factory=stored_now,
+        sa_type=DateTime,
+        sa_column_kwargs={"onupdate": stored_now},
+    )
@@ -0,0 +1,10 @@
+from datetime import datetime, timezone, timedelta
+
+EAT = timezone(timedelta(hours=3))
+
+# created_at and updated_at are plain DATETIME columns (sa_type=DateTime, so
+# newer SQLModel releases don't switch them to UTC) holding naive EAT wall
+# time in whole seconds. Setting them in that form up front means a write
+# response carries the same value that later reads of the row return.
+def stored_now() -> datetime:
+    return datetime.now(EAT).replace(tzinfo=None, microsecond=0)
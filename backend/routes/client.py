@@ -1,11 +1,45 @@
-from fastapi import APIRouter, Depends, HTTPException
-from core.database import get_session
-from core.security import hash_password
-from sqlmodel import Session, select
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, Request, Response, UploadFile, File
+from core.database import get_async_session
+from core.security import hash_password_async, hash_passwords_async
+from core.conditional import (
+    object_version, list_version, version_statement, is_not_modified, not_modified_response,
+    set_version_headers, conditional_entity_response,
+)
+from core.cache import cache, client_key, guarantor_key
+from core.export import export_response, ExportFormat
+from core.integrity import integrity_http_error
+from core.pagination import paginate, filter_created_range, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from core.rows import (
+    schema_columns, schema_fields, with_columns, row_dict, project, fetch_children, rows_response,
+    parse_fields, FIELDS_DESCRIPTION,
+)
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy import insert, or_
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload, selectinload
+from datetime import datetime
+from typing import Any, Optional
+from pydantic import ValidationError
+import csv
+import io
 from models import client_model
 from schemas import client_schema
-from core.sending_sms import send_sms
+from core.sms_outbox import queue_sms, queue_sms_bulk
+from core.uploads import release_blobs
+from core.photo_gc import discard_photo_files
+
+BULK_MAX_ROWS = 10000
+BULK_INSERT_CHUNK = 500
+
+# Related entities a single client read can embed
+CLIENT_INCLUDES = ("guarantors", "guarantors.photos")
+INCLUDE_DESCRIPTION = f"Comma separated related entities to embed: {', '.join(CLIENT_INCLUDES)}."
+
+CLIENT_UNIQUE = {
+    "national_id_number": "Duplicate national ID number",
+    "client_phone_number": "Duplicate phone number",
+}
 
 router = APIRouter(
     prefix="/clients",
@@ -14,28 +48,182 @@ router = APIRouter(
 
 # Get all clients
 @router.get("/", response_model=list[client_schema.Client])
-def get_all_clients(session: Session = Depends(get_session)):
-    clients = session.exec(select(client_model.Client)).all()
-    return clients
+async def get_all_clients(
+    request: Request,
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    marital_status: Optional[client_schema.MaritalStatus] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+    session: AsyncSession = Depends(get_async_session),
+):
+    Client = client_model.Client
+    Guarantor = client_model.Guarantor
+    requested = parse_fields(fields, client_schema.Client)
 
-# Get one client based on the client_id
-@router.get("/{client_id}", response_model=client_schema.Client)
-def get_client(client_id: str, session: Session = Depends(get_session)):
-    client = session.get(client_model.Client, client_id)
+    # Plain column rows, restricted to the requested fields; password_hash is never selected.
+    # The sort key and timestamps are always read for paging and the ETag.
+    columns = schema_columns(Client, client_schema.Client, requested)
+    output = [column.key for column in columns]
+    statement = select(*with_columns(columns, Client.client_id, Client.created_at, Client.updated_at))
+    if marital_status:
+        statement = statement.where(Client.marital_status == marital_status)
+    statement = filter_created_range(statement, Client.created_at, created_from, created_to)
+
+    clients = await paginate(session, statement, Client.created_at, Client.client_id, limit, cursor, response)
+
+    # Guarantors for the whole page in one extra query, with the timestamps the ETag needs
+    include_guarantors = requested is None or "guarantors" in requested
+    guarantors = await fetch_children(
+        session, Guarantor.client_id, [client.client_id for client in clients],
+        [Guarantor.guarantor_id, Guarantor.guarantor_name, Guarantor.created_at, Guarantor.updated_at],
+        [Guarantor.created_at, Guarantor.guarantor_id],
+    ) if include_guarantors else {}
+
+    version = list_version(
+        [object_version(client, guarantors[client.client_id] if include_guarantors else None) for client in clients],
+        response.headers.get("X-Next-Cursor", "") + (f"|{','.join(requested)}" if requested else ""),
+    )
+    if is_not_modified(request, version):
+        return not_modified_response(version)
+    set_version_headers(response, version)
+
+    guarantor_fields = schema_fields(client_schema.Guarantor_Lite)
+    body = []
+    for client in clients:
+        item = row_dict(client, output)
+        if include_guarantors:
+            item["guarantors"] = [row_dict(guarantor, guarantor_fields) for guarantor in guarantors[client.client_id]]
+        body.append(item)
+    return rows_response(body, response)
+
+# Export every client, streamed in chunks
+@router.get("/export")
+def export_clients(format: ExportFormat = ExportFormat.ndjson):
+    Client = client_model.Client
+    columns = [
+        Client.client_id, Client.client_name, Client.national_id_number,
+        Client.client_phone_number, Client.client_business_name, Client.client_residence,
+        Client.date_of_birth, Client.next_of_kin_name, Client.next_of_kin_contact,
+        Client.marital_status, Client.number_of_children, Client.created_at, Client.updated_at,
+    ]
+    return export_response(columns, format, "clients")
+
+def parse_includes(include: Optional[str]) -> set[str]:
+    includes = {name.strip() for name in (include or "").split(",") if name.strip()}
+    unknown = includes - set(CLIENT_INCLUDES)
+    if unknown:
+        raise HTTPException(status_code=422, detail=f"Unknown includes: {', '.join(sorted(unknown))}")
+    # Photos hang off the guarantors, so they can't come without them
+    if "guarantors.photos" in includes:
+        includes.add("guarantors")
+    return includes
+
+# The client, its guarantors and optionally their photos, each level loaded
+# with one selectinload query, so the whole graph takes at most three queries
+async def client_graph_response(
+    session: AsyncSession, request: Request, response: Response,
+    client_id: str, includes: set[str], requested: Optional[list[str]],
+):
+    Guarantor = client_model.Guarantor
+    with_photos = "guarantors.photos" in includes
+    guarantors_option = selectinload(client_model.Client.guarantors)
+    guarantors_option = (
+        guarantors_option.selectinload(Guarantor.guarantor_business_photos) if with_photos
+        else guarantors_option.noload(Guarantor.guarantor_business_photos)
+    )
+
+    client = await session.get(client_model.Client, client_id, options=[guarantors_option])
     if not client:
         raise HTTPException(status_code=404, detail="Client not found")
-    return client
+
+    # Same ordering as the list endpoints; sorting a loaded collection in place doesn't mark it changed
+    guarantors = client.guarantors
+    for guarantor in guarantors:
+        guarantor.guarantor_business_photos.sort(key=lambda photo: (photo.created_at, photo.image_id))
+
+    # Covers every embedded row, and differs from the plain read's ETag
+    versions = [object_version(client, guarantors)]
+    if with_photos:
+        versions += [object_version(guarantor, guarantor.guarantor_business_photos) for guarantor in guarantors]
+    version = list_version(versions, ",".join(sorted(includes)) + (f"|{','.join(requested)}" if requested else ""))
+    if is_not_modified(request, version):
+        return not_modified_response(version)
+    set_version_headers(response, version)
+
+    detail = client_schema.Client_Detail.model_validate(client, from_attributes=True)
+    detail.guarantors.sort(key=lambda guarantor: (guarantor.created_at, guarantor.guarantor_id))
+    exclude = None if with_photos else {"guarantors": {"__all__": {"guarantor_business_photos"}}}
+    data = detail.model_dump(mode="json", exclude=exclude)
+    if requested:
+        data = project(data, requested if "guarantors" in requested else requested + ["guarantors"])
+    return rows_response(data, response)
+
+# Get one client based on the client_id
+@router.get("/{client_id}", response_model=client_schema.Client)
+async def get_client(
+    client_id: str,
+    request: Request,
+    response: Response,
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+    include: Optional[str] = Query(None, description=INCLUDE_DESCRIPTION),
+    session: AsyncSession = Depends(get_async_session),
+):
+    requested = parse_fields(fields, client_schema.Client)
+
+    # Embedded reads aren't cached; photo changes don't invalidate the client entry
+    includes = parse_includes(include)
+    if includes:
+        return await client_graph_response(session, request, response, client_id, includes, requested)
+
+    async def read_fields(requested: list[str]) -> Optional[dict]:
+        columns = schema_columns(client_model.Client, client_schema.Client, requested)
+        data = {}
+        if columns:
+            row = (await session.execute(select(*columns).where(client_model.Client.client_id == client_id))).first()
+            if not row:
+                return None
+            data = row._asdict()
+        if "guarantors" in requested:
+            guarantors = await session.exec(
+                select(*schema_columns(client_model.Guarantor, client_schema.Guarantor_Lite))
+                .where(client_model.Guarantor.client_id == client_id)
+                .order_by(client_model.Guarantor.created_at, client_model.Guarantor.guarantor_id)
+            )
+            data["guarantors"] = [guarantor._asdict() for guarantor in guarantors]
+        return data
+
+    async def read_full():
+        client = await session.get(
+            client_model.Client, client_id,
+            options=[selectinload(client_model.Client.guarantors)],
+        )
+        if not client:
+            return None
+        data = client_schema.Client.model_validate(client, from_attributes=True).model_dump(mode="json")
+        return object_version(client, client.guarantors), data
+
+    return await conditional_entity_response(
+        request, response, session, client_key(client_id), requested,
+        version_statement(
+            client_model.Client, client_model.Client.client_id, client_id,
+            client_model.Guarantor, client_model.Guarantor.client_id,
+        ),
+        "Client not found", read_fields, read_full,
+    )
 
 # Create a client
 @router.post("/", response_model=client_schema.Client)
-def create_client(client_data: client_schema.Client_Request, session: Session = Depends(get_session)):
+async def create_client(client_data: client_schema.Client_Request, session: AsyncSession = Depends(get_async_session)):
     if client_data.next_of_kin_contact == client_data.client_phone_number:
         raise HTTPException(
             status_code=422,
             detail="The next of kin contact shouldn't be similar to the primary contact"
         )
 
-    hashed_pw = hash_password(client_data.password)
+    hashed_pw = await hash_password_async(client_data.password)
 
     client = client_model.Client(
         client_name=client_data.client_name,
@@ -48,136 +236,267 @@ def create_client(client_data: client_schema.Client_Request, session: Session =
         next_of_kin_name=client_data.next_of_kin_name,
         next_of_kin_contact=client_data.next_of_kin_contact,
         marital_status=client_data.marital_status,
-        number_of_children=client_data.number_of_children
+        number_of_children=client_data.number_of_children,
+        # A new client has no guarantors, so there's nothing to refresh after the commit
+        guarantors=[],
+    )
+
+    # Queue SMS to next-of-kin only, committed together with the client
+    queue_sms(
+        session,
+        client.next_of_kin_contact,
+        f"Hello {client.next_of_kin_name}, {client.client_name}'s account has been created successfully."
     )
 
+    # Duplicates are caught by the unique constraints, not a SELECT beforehand
     try:
         session.add(client)
-        session.commit()
-        session.refresh(client)
-    except IntegrityError:
-        session.rollback()
-        raise HTTPException(status_code=400, detail="Duplicate national ID number")
-
-    # Send SMS to next-of-kin only
-    sms_status = {"kin_sms": False}
-    try:
-        result = send_sms(
-            client.next_of_kin_contact,
-            f"Hello {client.next_of_kin_name}, {client.client_name}'s account has been created successfully."
-        )
-        sms_status["kin_sms"] = result.get("status") != "failed"
-    except Exception as e:
-        print(f"Next-of-kin SMS failed: {str(e)}")
+        await session.commit()
+    except IntegrityError as e:
+        await session.rollback()
+        raise integrity_http_error(e, CLIENT_UNIQUE)
 
     return client
 
+def chunked(items: list, size: int):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def kin_sms(client: client_model.Client) -> tuple[str, str]:
+    return (
+        client.next_of_kin_contact,
+        f"Hello {client.next_of_kin_name}, {client.client_name}'s account has been created successfully."
+    )
+
+# Validate, hash and insert a batch of clients, collecting errors per row
+async def onboard_clients(rows: list[dict[str, Any]], session: AsyncSession) -> client_schema.BulkClientResult:
+    if len(rows) > BULK_MAX_ROWS:
+        raise HTTPException(status_code=413, detail=f"At most {BULK_MAX_ROWS} clients per upload")
+
+    errors: dict[int, list[str]] = {}
+
+    # Validate each row and catch duplicates within the upload itself
+    valid = []
+    seen_ids, seen_phones = {}, {}
+    for row_number, row in enumerate(rows, start=1):
+        try:
+            data = client_schema.Client_Request.model_validate(row)
+        except ValidationError as e:
+            errors[row_number] = [
+                f"{'.'.join(str(part) for part in err['loc'])}: {err['msg']}" for err in e.errors()
+            ]
+            continue
+
+        problems = []
+        if data.next_of_kin_contact == data.client_phone_number:
+            problems.append("The next of kin contact shouldn't be similar to the primary contact")
+        if data.national_id_number in seen_ids:
+            problems.append(f"Duplicate national ID number (row {seen_ids[data.national_id_number]})")
+        if data.client_phone_number in seen_phones:
+            problems.append(f"Duplicate phone number (row {seen_phones[data.client_phone_number]})")
+        if problems:
+            errors[row_number] = problems
+            continue
+
+        seen_ids[data.national_id_number] = row_number
+        seen_phones[data.client_phone_number] = row_number
+        valid.append((row_number, data))
+
+    # Catch duplicates of existing clients, one query per chunk
+    existing_ids, existing_phones = set(), set()
+    for chunk in chunked(valid, BULK_INSERT_CHUNK):
+        statement = select(
+            client_model.Client.national_id_number, client_model.Client.client_phone_number
+        ).where(or_(
+            client_model.Client.national_id_number.in_([data.national_id_number for _, data in chunk]),
+            client_model.Client.client_phone_number.in_([data.client_phone_number for _, data in chunk]),
+        ))
+        for national_id_number, phone_number in await session.exec(statement):
+            existing_ids.add(national_id_number)
+            existing_phones.add(phone_number)
+
+    pending = []
+    for row_number, data in valid:
+        problems = []
+        if data.national_id_number in existing_ids:
+            problems.append("Duplicate national ID number")
+        if data.client_phone_number in existing_phones:
+            problems.append("Duplicate phone number")
+        if problems:
+            errors[row_number] = problems
+        else:
+            pending.append((row_number, data))
+
+    # The duplicate check only read. Ending its transaction hands the
+    # connection back to the pool while the passwords are hashed, instead of
+    # idling inside an open snapshot; the inserts start a fresh one.
+    await session.rollback()
+    hashes = await hash_passwords_async([data.password for _, data in pending])
+    clients = [
+        (row_number, client_model.Client.model_validate(
+            {**data.model_dump(exclude={"password"}), "password_hash": hashed_pw}
+        ))
+        for (row_number, data), hashed_pw in zip(pending, hashes)
+    ]
+
+    created_ids = []
+    for chunk in chunked(clients, BULK_INSERT_CHUNK):
+        try:
+            async with session.begin_nested():
+                await session.execute(insert(client_model.Client), [client.model_dump() for _, client in chunk])
+                await queue_sms_bulk(session, [kin_sms(client) for _, client in chunk])
+            created_ids.extend(client.client_id for _, client in chunk)
+        except IntegrityError:
+            # A conflicting client was registered meanwhile, find it row by row
+            for row_number, client in chunk:
+                try:
+                    async with session.begin_nested():
+                        await session.execute(insert(client_model.Client), [client.model_dump()])
+                        await queue_sms_bulk(session, [kin_sms(client)])
+                    created_ids.append(client.client_id)
+                except IntegrityError:
+                    errors[row_number] = ["Duplicate national ID number or phone number"]
+
+    await session.commit()
+
+    return client_schema.BulkClientResult(
+        created=len(created_ids),
+        client_ids=created_ids,
+        errors=[
+            client_schema.BulkRowError(row=row_number, errors=problems)
+            for row_number, problems in sorted(errors.items())
+        ],
+    )
+
+# Create many clients from a JSON array
+@router.post("/bulk", response_model=client_schema.BulkClientResult)
+async def bulk_create_clients(rows: list[dict[str, Any]], session: AsyncSession = Depends(get_async_session)):
+    return await onboard_clients(rows, session)
+
+# Create many clients from a CSV upload with a header row
+@router.post("/bulk/csv", response_model=client_schema.BulkClientResult)
+async def bulk_create_clients_csv(file: UploadFile = File(...), session: AsyncSession = Depends(get_async_session)):
+    try:
+        text = (await file.read()).decode("utf-8-sig")
+        rows = list(csv.DictReader(io.StringIO(text)))
+    except (UnicodeDecodeError, csv.Error):
+        raise HTTPException(status_code=400, detail="Invalid CSV file")
+    return await onboard_clients(rows, session)
+
 # Update password only
 @router.patch("/{client_id}/password")
-def update_client_password(client_id: str, password_data: client_schema.PasswordUpdate, session: Session = Depends(get_session)):
-    client = session.get(client_model.Client, client_id)
+async def update_client_password(client_id: str, password_data: client_schema.PasswordUpdate, session: AsyncSession = Depends(get_async_session)):
+    # Hashed before the first query, so no pooled connection is held while it runs
+    hashed_pw = await hash_password_async(password_data.password)
+
+    client = await session.get(client_model.Client, client_id)
     if not client:
         raise HTTPException(status_code=404, detail="Client not found")
 
-    client.password_hash = hash_password(password_data.password)
+    client.password_hash = hashed_pw
+
+    # Queue SMS to client
+    queue_sms(
+        session,
+        client.client_phone_number,
+        f"Hello {client.client_name}, your password has been updated successfully."
+    )
 
     try:
-        session.commit()
-        session.refresh(client)
+        await session.commit()
     except Exception:
-        session.rollback()
+        await session.rollback()
         raise HTTPException(status_code=500, detail="Failed to update password")
 
-    # Send SMS to client
-    sms_status = {"client_sms": False}
-    try:
-        result = send_sms(
-            client.client_phone_number,
-            f"Hello {client.client_name}, your password has been updated successfully."
-        )
-        sms_status["client_sms"] = result.get("status") != "failed"
-    except Exception as e:
-        print(f"Client SMS failed: {str(e)}")
+    await cache.delete(client_key(client_id))
 
     return {"Response": "Updated the password"}
 
 # Update client
 @router.put("/{client_id}", response_model=client_schema.Client)
-def update_client(client_id: str, client_update: client_schema.Client_Request, session: Session = Depends(get_session)):
-    client = session.get(client_model.Client, client_id)
+async def update_client(client_id: str, client_update: client_schema.Client_Request, session: AsyncSession = Depends(get_async_session)):
+    update_data = client_update.dict(exclude_unset=True)
+
+    # Hashed before the first query, so no pooled connection is held while it runs
+    hashed_pw = None
+    if "password" in update_data:
+        hashed_pw = await hash_password_async(update_data.pop("password"))
+
+    # The previous next-of-kin contact is needed to tell whether to notify the new one.
+    # The guarantors for the response come in the same query, so nothing is refreshed after the commit.
+    client = await session.get(
+        client_model.Client, client_id,
+        options=[joinedload(client_model.Client.guarantors)],
+    )
     if not client:
         raise HTTPException(status_code=404, detail="Client not found")
 
-    update_data = client_update.dict(exclude_unset=True)
-
     # Track if next-of-kin contact changed
     next_of_kin_updated = False
     if "next_of_kin_contact" in update_data:
         if update_data["next_of_kin_contact"] != client.next_of_kin_contact:
             next_of_kin_updated = True
 
-    # Handle password separately
-    if "password" in update_data:
-        hashed_pw = hash_password(update_data.pop("password"))
+    if hashed_pw is not None:
         client.password_hash = hashed_pw
 
     # Update other fields
     for key, value in update_data.items():
         setattr(client, key, value)
 
-    try:
-        session.commit()
-        session.refresh(client)
-    except IntegrityError:
-        session.rollback()
-        raise HTTPException(
-            status_code=400,
-            detail="Duplicate national ID number or other constraint violated"
-        )
+    # Queue SMS to client
+    queue_sms(
+        session,
+        client.client_phone_number,
+        f"Hello {client.client_name}, your profile has been updated successfully."
+    )
 
-    # Send SMS to client
-    sms_status = {"client_sms": False, "kin_sms": False}
-    try:
-        result = send_sms(
-            client.client_phone_number,
-            f"Hello {client.client_name}, your profile has been updated successfully."
+    # Queue SMS to next-of-kin if contact updated
+    if next_of_kin_updated:
+        queue_sms(
+            session,
+            client.next_of_kin_contact,
+            f"Hello {client.next_of_kin_name}, your contact info has been updated for {client.client_name}'s account as the next of kin."
         )
-        sms_status["client_sms"] = result.get("status") != "failed"
-    except Exception as e:
-        print(f"Client SMS failed: {str(e)}")
 
-    # Send SMS to next-of-kin if contact updated
-    if next_of_kin_updated:
-        try:
-            result = send_sms(
-                client.next_of_kin_contact,
-                f"Hello {client.next_of_kin_name}, your contact info has been updated for {client.client_name}'s account as the next of kin."
-            )
-            sms_status["kin_sms"] = result.get("status") != "failed"
-        except Exception as e:
-            print(f"Next-of-kin SMS failed: {str(e)}")
+    try:
+        await session.commit()
+    except IntegrityError as e:
+        await session.rollback()
+        raise integrity_http_error(e, CLIENT_UNIQUE)
 
+    await cache.delete(client_key(client_id))
     return client
 
 # Delete client
 @router.delete("/{client_id}")
-def delete_client(client_id: str, session: Session = Depends(get_session)):
-    client = session.get(client_model.Client, client_id)
+async def delete_client(
+    client_id: str,
+    background_tasks: BackgroundTasks,
+    session: AsyncSession = Depends(get_async_session),
+):
+    client = await session.get(client_model.Client, client_id)
     if not client:
         raise HTTPException(status_code=404, detail="Client not found")
 
-    session.delete(client)
-    session.commit()
+    # Queue SMS to client
+    queue_sms(
+        session,
+        client.client_phone_number,
+        f"Hello {client.client_name}, your account has been deleted."
+    )
 
-    # Send SMS to client
-    sms_status = {"client_sms": False}
-    try:
-        result = send_sms(
-            client.client_phone_number,
-            f"Hello {client.client_name}, your account has been deleted."
-        )
-        sms_status["client_sms"] = result.get("status") != "failed"
-    except Exception as e:
-        print(f"Client SMS failed: {str(e)}")
+    # Only the ids are read, for cache invalidation; the rows go with the database cascade
+    guarantor_ids = (await session.exec(
+        select(client_model.Guarantor.guarantor_id).where(client_model.Guarantor.client_id == client_id)
+    )).all()
+
+    released = await release_blobs(session, client_model.Guarantor_business_photos.guarantor_id.in_(guarantor_ids))
+    await session.delete(client)
+    await session.commit()
+
+    await cache.delete(client_key(client_id), *map(guarantor_key, guarantor_ids))
+    # Photo files of the client's guarantors are removed after the response is sent
+    background_tasks.add_task(discard_photo_files, released)
 
     return {"message": "Deleted client"}
\ No newline at end of file
@@ -1,11 +1,24 @@
-from fastapi import APIRouter, Depends, HTTPException
-from core.database import get_session
-from core.security import hash_password
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from core.database import get_async_session
+from core.security import hash_password_async
+from core.conditional import (
+    object_version, list_version, version_statement, is_not_modified, not_modified_response,
+    set_version_headers, conditional_entity_response,
+)
+from core.cache import cache, employee_key
+from core.integrity import integrity_http_error
+from core.pagination import paginate, filter_created_range, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from core.rows import schema_columns, with_columns, row_dict, rows_response, parse_fields, FIELDS_DESCRIPTION
 from models import employee_model
 from schemas import employee_schema
-from sqlmodel import Session, select
-from core.sending_sms import send_sms
-from typing import List
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy.exc import IntegrityError
+from core.sms_outbox import queue_sms
+from datetime import datetime
+from typing import List, Optional
+
+EMPLOYEE_UNIQUE = {"employee_phone_number": "Phone number has already been used."}
 
 router = APIRouter(
 	prefix="/employees",
@@ -14,29 +27,78 @@ router = APIRouter(
 
 # Get all the employees
 @router.get("/", response_model=List[employee_schema.Employee])
-def get_employees(session: Session = Depends(get_session)):
-	employees = session.exec(select(employee_model.Employee)).all()
-	return employees
+async def get_employees(
+	request: Request,
+	response: Response,
+	limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+	cursor: Optional[str] = None,
+	employee_type: Optional[employee_schema.Employee_type] = None,
+	created_from: Optional[datetime] = None,
+	created_to: Optional[datetime] = None,
+	fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+	session: AsyncSession = Depends(get_async_session),
+):
+	requested = parse_fields(fields, employee_schema.Employee)
+
+	# Plain column rows; password_hash is never selected. The sort key and
+	# timestamps are always read for paging and the ETag.
+	columns = schema_columns(employee_model.Employee, employee_schema.Employee, requested)
+	output = [column.key for column in columns]
+	statement = select(*with_columns(
+		columns,
+		employee_model.Employee.employee_id, employee_model.Employee.created_at, employee_model.Employee.updated_at,
+	))
+	if employee_type:
+		statement = statement.where(employee_model.Employee.employee_type == employee_type)
+	statement = filter_created_range(statement, employee_model.Employee.created_at, created_from, created_to)
+
+	employees = await paginate(
+		session, statement,
+		employee_model.Employee.created_at, employee_model.Employee.employee_id,
+		limit, cursor, response,
+	)
+
+	version = list_version(
+		[object_version(employee) for employee in employees],
+		response.headers.get("X-Next-Cursor", "") + (f"|{','.join(requested)}" if requested else ""),
+	)
+	if is_not_modified(request, version):
+		return not_modified_response(version)
+	set_version_headers(response, version)
+	return rows_response([row_dict(employee, output) for employee in employees], response)
 
 # Get one employee based on the employee_id
 @router.get("/{employee_id}", response_model=employee_schema.Employee)
-def get_employee(employee_id: str, session: Session = Depends(get_session)):
-    employee = session.get(employee_model.Employee, employee_id)
-    if not employee:
-        raise HTTPException(status_code=404, detail="Employee not found")
-    return employee
-
-@router.post("/", response_model=employee_schema.Employee)
-def create_employee(employee_data: employee_schema.Employee_Base, session:Session = Depends(get_session)):
-    statement = select(employee_model.Employee).where(
-        employee_model.Employee.employee_phone_number == employee_data.employee_phone_number
+async def get_employee(
+    employee_id: str,
+    request: Request,
+    response: Response,
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+    session: AsyncSession = Depends(get_async_session),
+):
+    requested = parse_fields(fields, employee_schema.Employee)
+
+    async def read_fields(requested: list[str]) -> Optional[dict]:
+        columns = schema_columns(employee_model.Employee, employee_schema.Employee, requested)
+        row = (await session.execute(select(*columns).where(employee_model.Employee.employee_id == employee_id))).first()
+        return row._asdict() if row else None
+
+    async def read_full():
+        employee = await session.get(employee_model.Employee, employee_id)
+        if not employee:
+            return None
+        data = employee_schema.Employee.model_validate(employee, from_attributes=True).model_dump(mode="json")
+        return object_version(employee), data
+
+    return await conditional_entity_response(
+        request, response, session, employee_key(employee_id), requested,
+        version_statement(employee_model.Employee, employee_model.Employee.employee_id, employee_id),
+        "Employee not found", read_fields, read_full,
     )
 
-    phone_number = session.exec(statement).first()
-    if phone_number:
-        raise HTTPException(status_code=422, detail="Phone number has already been used.")
-
-    hashed_pw = hash_password(employee_data.password_hash)
+@router.post("/", response_model=employee_schema.Employee)
+async def create_employee(employee_data: employee_schema.Employee_Base, session: AsyncSession = Depends(get_async_session)):
+    hashed_pw = await hash_password_async(employee_data.password_hash)
 
     employee = employee_model.Employee(
             employee_name=employee_data.employee_name,
@@ -45,118 +107,98 @@ def create_employee(employee_data: employee_schema.Employee_Base, session:Sessio
             password_hash=hashed_pw
         )
 
-    session.add(employee)
-    session.commit()
-    session.refresh(employee)
+    # Queue confirmation SMS with the new employee
+    message = f"Hello {employee.employee_name}, this is just a confirmation for your registration."
+    queue_sms(session, employee.employee_phone_number, message)
 
-    # Prepare SMS message
-    sms_status = {"employee_sms": False}
+    # A phone number already in use is caught by the unique constraint
     try:
-        message = f"Hello {employee.employee_name}, this is just a confirmation for your registration."
-        result = send_sms(employee.employee_phone_number, message)
-        sms_status["employee_sms"] = result.get("status") != "failed"
-    except Exception as e:
-        print(f"employee SMS failed: {str(e)}")
+        session.add(employee)
+        await session.commit()
+    except IntegrityError as e:
+        await session.rollback()
+        raise integrity_http_error(e, EMPLOYEE_UNIQUE)
 
     return employee
 
 # Update password only
 @router.patch("/{employee_id}/password")
-def update_employee_password(employee_id: str, password_data: employee_schema.PasswordUpdate, session: Session = Depends(get_session)):
-    employee = session.get(employee_model.Employee, employee_id)
+async def update_employee_password(employee_id: str, password_data: employee_schema.PasswordUpdate, session: AsyncSession = Depends(get_async_session)):
+    # Hashed before the first query, so no pooled connection is held while it runs
+    hashed_pw = await hash_password_async(password_data.password)
+
+    employee = await session.get(employee_model.Employee, employee_id)
     if not employee:
         raise HTTPException(status_code=404, detail="Employee not found")
 
-    employee.password_hash = hash_password(password_data.password)
+    employee.password_hash = hashed_pw
+
+    # Queue SMS to employee
+    queue_sms(
+        session,
+        employee.employee_phone_number,
+        f"Hello {employee.employee_name}, your password has been updated successfully."
+    )
 
     try:
-        session.commit()
-        session.refresh(employee)
+        await session.commit()
     except Exception:
-        session.rollback()
+        await session.rollback()
         raise HTTPException(status_code=500, detail="Failed to update password")
 
-    # Send SMS to employee
-    sms_status = {"sms": False}
-    try:
-        result = send_sms(
-            employee.employee_phone_number,
-            f"Hello {employee.employee_name}, your password has been updated successfully."
-        )
-        sms_status["sms"] = result.get("status") != "failed"
-    except Exception as e:
-        print(f"SMS failed: {str(e)}")
+    await cache.delete(employee_key(employee_id))
 
     return {"Response": "Updated the password"}
 
 # Update Phone number only
 @router.patch("/{employee_id}/phone_number")
-def update_employee_phone_number(
+async def update_employee_phone_number(
     employee_id: str,
     number_data: employee_schema.PhoneNumberUpdate,
-    session: Session = Depends(get_session)
+    session: AsyncSession = Depends(get_async_session)
 ):
-    employee = session.get(employee_model.Employee, employee_id)
+    employee = await session.get(employee_model.Employee, employee_id)
     if not employee:
         raise HTTPException(status_code=404, detail="Employee not found")
 
-    statement = select(employee_model.Employee).where(
-        employee_model.Employee.employee_phone_number == number_data.phone_number
-    )
-
-    existing_employee = session.exec(statement).first()
-
-    if existing_employee and existing_employee.id != employee_id:
-        raise HTTPException(
-            status_code=422,
-            detail="Phone number already in use"
-        )
-
     employee.employee_phone_number = number_data.phone_number
 
-    try:
-        session.add(employee)
-        session.commit()
-        session.refresh(employee)
-    except Exception:
-        session.rollback()
-        raise HTTPException(
-            status_code=500,
-            detail="Failed to update the phone number"
-        )
+    # Queue SMS to employee
+    queue_sms(
+        session,
+        employee.employee_phone_number,
+        f"Hello {employee.employee_name}, your phone number has been updated successfully."
+    )
 
-    # Send SMS to employee
-    sms_status = {"sms": False}
+    # Another employee's number is caught by the unique constraint; keeping
+    # the same number is a no-op for it
     try:
-        result = send_sms(
-            employee.employee_phone_number,
-            f"Hello {employee.employee_name}, your phone number has been updated successfully."
-        )
-        sms_status["sms"] = result.get("status") != "failed"
-    except Exception as e:
-        print(f"SMS failed: {str(e)}")
+        await session.commit()
+    except IntegrityError as e:
+        await session.rollback()
+        raise integrity_http_error(e, {"employee_phone_number": "Phone number already in use"})
+
+    await cache.delete(employee_key(employee_id))
 
     return {"Response": "Updated the phone number"}
 
 # Delete employee
 @router.delete("/{employee_id}")
-def delete_employee(employee_id: str, session: Session = Depends(get_session)):
-    employee = session.get(employee_model.Employee, employee_id)
+async def delete_employee(employee_id: str, session: AsyncSession = Depends(get_async_session)):
+    employee = await session.get(employee_model.Employee, employee_id)
     if not employee:
         raise HTTPException(status_code=404, detail="Employee not found")
 
-    session.delete(employee)
-    session.commit()
+    # Queue SMS to employee
+    queue_sms(
+        session,
+        employee.employee_phone_number,
+        f"Hello {employee.employee_name}, your account has been deleted."
+    )
 
-    # Send SMS to employee
-    sms_status = {"sms": False}
-    try:
-        result = send_sms(
-            employee.employee_phone_number,
-            f"Hello {employee.employee_name}, your account has been deleted."
-        )
-        sms_status["sms"] = result.get("status") != "failed"
-    except Exception as e:
-        print(f"SMS failed: {str(e)}")
+    await session.delete(employee)
+    await session.commit()
+
+    await cache.delete(employee_key(employee_id))
 
     return {"message": "Deleted employee"}
\ No newline at end of file
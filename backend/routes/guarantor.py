@@ -1,20 +1,44 @@
-from fastapi import APIRouter, Depends, UploadFile, File, HTTPException
-from fastapi.staticfiles import StaticFiles
+from fastapi import APIRouter, BackgroundTasks, Depends, UploadFile, File, HTTPException, Query, Request, Response
+from sqlalchemy import delete
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm import selectinload
-from core.database import get_session
-from sqlmodel import Session, select
+from sqlalchemy.orm import joinedload, selectinload
+from core.database import get_async_session
+from core.body_limit import max_body_size
+from core.conditional import (
+    object_version, list_version, version_statement, is_not_modified, not_modified_response,
+    set_version_headers, conditional_entity_response,
+)
+from core.cache import cache, client_key, guarantor_key
+from core.export import export_response, ExportFormat
+from core.integrity import integrity_http_error
+from core.pagination import paginate, filter_created_range, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from core.rows import (
+    schema_columns, with_columns, row_dict, fetch_children, rows_response,
+    parse_fields, FIELDS_DESCRIPTION,
+)
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from models import client_model
 from schemas import client_schema
-from core.sending_sms import send_sms
-from typing import List
-import os
-import uuid
-import aiofiles
+from core.sms_outbox import queue_sms
+from core.uploads import save_uploads, remove_created, acquire_blobs, release_blobs
+from core.image_processing import notify_photos_queued
+from core.photo_serving import UPLOAD_DIR, photo_url
+from core.photo_gc import discard_photo_files
+from datetime import datetime
+from typing import List, Optional
 
-UPLOAD_DIR = "uploads/guarantors"
 ALLOWED_TYPES = {"image/jpeg", "image/png", "image/webp"}
 MAX_FILE_SIZE = 5 * 1024 * 1024
+MAX_PHOTOS_PER_UPLOAD = 10
+# Room for the multipart boundaries and part headers around the files
+MAX_UPLOAD_BODY = MAX_PHOTOS_PER_UPLOAD * MAX_FILE_SIZE + 64 * 1024
+
+GUARANTOR_UNIQUE = {
+    "national_id_number": "Duplicate national ID number",
+    "guarantor_phone_number": "Duplicate phone number",
+}
+GUARANTOR_REFERENCES = {"client_id": "Client not found"}
 
 router = APIRouter(
 			prefix="/guarantor", 
@@ -23,92 +47,169 @@ router = APIRouter(
 
 # Guarantor routes
 @router.get("/", response_model=List[client_schema.Guarantor])
-def list_guarantors(session: Session = Depends(get_session)):
-    guarantors = session.exec(select(client_model.Guarantor)).all()
-    response_guarantors: List[client_schema.Guarantor] = []
+async def list_guarantors(
+    request: Request,
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    client_id: Optional[str] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+    session: AsyncSession = Depends(get_async_session),
+):
+    Guarantor = client_model.Guarantor
+    Photo = client_model.Guarantor_business_photos
+    requested = parse_fields(fields, client_schema.Guarantor)
+
+    # The sort key and timestamps are always read for paging and the ETag
+    columns = schema_columns(Guarantor, client_schema.Guarantor, requested)
+    output = [column.key for column in columns]
+    statement = select(*with_columns(columns, Guarantor.guarantor_id, Guarantor.created_at, Guarantor.updated_at))
+    if client_id:
+        statement = statement.where(Guarantor.client_id == client_id)
+    statement = filter_created_range(statement, Guarantor.created_at, created_from, created_to)
+
+    guarantors = await paginate(session, statement, Guarantor.created_at, Guarantor.guarantor_id, limit, cursor, response)
+
+    # Photos for the whole page in one extra query, with the timestamps the ETag needs
+    include_photos = requested is None or "guarantor_business_photos" in requested
+    photos = await fetch_children(
+        session, Photo.guarantor_id, [guarantor.guarantor_id for guarantor in guarantors],
+        [Photo.image_id, Photo.link, Photo.display_link, Photo.thumbnail_link, Photo.created_at, Photo.updated_at],
+        [Photo.created_at, Photo.image_id],
+    ) if include_photos else {}
+
+    version = list_version(
+        [object_version(guarantor, photos[guarantor.guarantor_id] if include_photos else None) for guarantor in guarantors],
+        response.headers.get("X-Next-Cursor", "") + (f"|{','.join(requested)}" if requested else ""),
+    )
+    if is_not_modified(request, version):
+        return not_modified_response(version)
+    set_version_headers(response, version)
 
+    body = []
     for guarantor in guarantors:
-        # Load the business photos for this guarantor
-        photos = session.exec(
-            select(client_model.Guarantor_business_photos)
-            .where(client_model.Guarantor_business_photos.guarantor_id == guarantor.guarantor_id)
-        ).all()
-
-        guarantor_business_photos = [
-            client_schema.GuarantorBusinessPhotoLite(
-                image_id=photo.image_id,
-                link=photo.link
-            )
-            for photo in photos
-        ]
-
-        response_guarantors.append(
-            client_schema.Guarantor(
-                guarantor_id=guarantor.guarantor_id,
-                client_id=guarantor.client_id,
-                guarantor_name=guarantor.guarantor_name,
-                national_id_number=guarantor.national_id_number,
-                guarantor_phone_number=guarantor.guarantor_phone_number,
-                guarantor_business_name=guarantor.guarantor_business_name,
-                guarantor_business_location=guarantor.guarantor_business_location,
-                created_at=guarantor.created_at,
-                updated_at=guarantor.updated_at,
-                guarantor_business_photos=guarantor_business_photos
-            )
-        )
-
-    return response_guarantors
+        item = row_dict(guarantor, output)
+        if include_photos:
+            item["guarantor_business_photos"] = [photo_dict(photo) for photo in photos[guarantor.guarantor_id]]
+        body.append(item)
+    return rows_response(body, response)
+
+# Same shape as GuarantorBusinessPhotoLite, with links turned into URLs
+def photo_dict(photo) -> dict:
+    return {
+        "image_id": photo.image_id,
+        "link": photo_url(photo.link),
+        "display_link": photo_url(photo.display_link),
+        "thumbnail_link": photo_url(photo.thumbnail_link),
+    }
+
+# Export every guarantor, streamed in chunks
+@router.get("/export")
+def export_guarantors(format: ExportFormat = ExportFormat.ndjson):
+    Guarantor = client_model.Guarantor
+    columns = [
+        Guarantor.guarantor_id, Guarantor.client_id, Guarantor.guarantor_name,
+        Guarantor.national_id_number, Guarantor.guarantor_phone_number,
+        Guarantor.guarantor_business_name, Guarantor.guarantor_business_location,
+        Guarantor.created_at, Guarantor.updated_at,
+    ]
+    return export_response(columns, format, "guarantors")
 
 @router.get("/{guarantor_id}", response_model=client_schema.Guarantor)
-def get_guarantor(guarantor_id: str, session: Session = Depends(get_session)):
-
-    statement = (
-        select(client_model.Guarantor)
-        .where(client_model.Guarantor.guarantor_id == guarantor_id)
-        .options(selectinload(client_model.Guarantor.guarantor_business_photos))
+async def get_guarantor(
+    guarantor_id: str,
+    request: Request,
+    response: Response,
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+    session: AsyncSession = Depends(get_async_session),
+):
+    requested = parse_fields(fields, client_schema.Guarantor)
+
+    Photo = client_model.Guarantor_business_photos
+
+    async def read_fields(requested: list[str]) -> Optional[dict]:
+        columns = schema_columns(client_model.Guarantor, client_schema.Guarantor, requested)
+        data = {}
+        if columns:
+            row = (await session.execute(select(*columns).where(client_model.Guarantor.guarantor_id == guarantor_id))).first()
+            if not row:
+                return None
+            data = row._asdict()
+        if "guarantor_business_photos" in requested:
+            photos = await session.exec(
+                select(Photo.image_id, Photo.link, Photo.display_link, Photo.thumbnail_link)
+                .where(Photo.guarantor_id == guarantor_id)
+                .order_by(Photo.created_at, Photo.image_id)
+            )
+            data["guarantor_business_photos"] = [photo_dict(photo) for photo in photos]
+        return data
+
+    async def read_full():
+        statement = (
+            select(client_model.Guarantor)
+            .where(client_model.Guarantor.guarantor_id == guarantor_id)
+            .options(selectinload(client_model.Guarantor.guarantor_business_photos))
+        )
+        guarantor = (await session.exec(statement)).first()
+        if not guarantor:
+            return None
+        data = client_schema.Guarantor.model_validate(guarantor, from_attributes=True).model_dump(mode="json")
+        return object_version(guarantor, guarantor.guarantor_business_photos), data
+
+    return await conditional_entity_response(
+        request, response, session, guarantor_key(guarantor_id), requested,
+        version_statement(
+            client_model.Guarantor, client_model.Guarantor.guarantor_id, guarantor_id,
+            Photo, Photo.guarantor_id,
+        ),
+        "Guarantor not found", read_fields, read_full,
     )
 
-    guarantor = session.exec(statement).first()
-
-    if not guarantor:
-        raise HTTPException(404, "Guarantor not found")
-
-    return guarantor
-
 @router.post("/", response_model=client_schema.Guarantor)
-def create_guarantor(
+async def create_guarantor(
     guarantor_data: client_schema.Guarantor_Base,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_async_session),
 ):
-    guarantor = client_model.Guarantor(**guarantor_data.model_dump())
+    # Only the name is needed, for the SMS
+    client_name = (await session.exec(
+        select(client_model.Client.client_name).where(client_model.Client.client_id == guarantor_data.client_id)
+    )).first()
+    if client_name is None:
+        raise HTTPException(status_code=404, detail="Client not found")
 
-    try:
-        session.add(guarantor)
-        session.commit()
-        session.refresh(guarantor)
+    # A new guarantor has no photos, so there's nothing to refresh after the commit
+    guarantor = client_model.Guarantor(**guarantor_data.model_dump(), guarantor_business_photos=[])
 
-        # Prepare SMS message
-        sms_status = {"guarantor_sms": False}
-        try:
-            message = f"Hello {guarantor.guarantor_name}, you have been added as a guarantor for {guarantor.client.client_name}'s account."
-            result = send_sms(guarantor.guarantor_phone_number, message)
-            sms_status["guarantor_sms"] = result.get("status") != "failed"
-        except Exception as e:
-            print(f"Guarantor SMS failed: {str(e)}")
+    # Queue SMS to guarantor, committed together with the guarantor
+    message = f"Hello {guarantor.guarantor_name}, you have been added as a guarantor for {client_name}'s account."
+    queue_sms(session, guarantor.guarantor_phone_number, message)
 
-        # Return guarantor with SMS status
-        return {**guarantor.__dict__, "sms_status": sms_status}
+    # Duplicates, and a client deleted in the meantime, are caught by the constraints
+    try:
+        session.add(guarantor)
+        await session.commit()
+    except IntegrityError as e:
+        await session.rollback()
+        raise integrity_http_error(e, GUARANTOR_UNIQUE, GUARANTOR_REFERENCES)
 
-    except IntegrityError:
-        session.rollback()
-        raise HTTPException(status_code=400, detail="Duplicate national ID number")
+    # The client's guarantor list changed
+    await cache.delete(client_key(guarantor.client_id))
+    return guarantor
 
 @router.put("/{guarantor_id}", response_model=client_schema.Guarantor)
-def update_guarantor(guarantor_id: str, guarantor_update: client_schema.Guarantor_Base, session: Session = Depends(get_session)):
-    guarantor = session.get(client_model.Guarantor, guarantor_id)
+async def update_guarantor(guarantor_id: str, guarantor_update: client_schema.Guarantor_Base, session: AsyncSession = Depends(get_async_session)):
+    # Photos for the response come in the same query, so nothing is refreshed after the commit
+    guarantor = await session.get(
+        client_model.Guarantor, guarantor_id,
+        options=[joinedload(client_model.Guarantor.guarantor_business_photos)],
+    )
     if not guarantor:
         raise HTTPException(status_code=404, detail="Guarantor not found")
 
+    previous_client_id = guarantor.client_id
+
     # Track if phone number changed
     phone_updated = False
     update_data = guarantor_update.dict()
@@ -120,99 +221,131 @@ def update_guarantor(guarantor_id: str, guarantor_update: client_schema.Guaranto
     for key, value in update_data.items():
         setattr(guarantor, key, value)
 
+    # Queue SMS to guarantor
+    message = f"Hello {guarantor.guarantor_name}, your profile has been updated successfully."
+    queue_sms(session, guarantor.guarantor_phone_number, message)
+
+    # Moving the guarantor to a client that doesn't exist fails the foreign key
     try:
-        session.commit()
-        session.refresh(guarantor)
-    except IntegrityError:
-        session.rollback()
-        raise HTTPException(status_code=400, detail="Duplicate national ID number or other constraint violated")
-
-    # Send SMS to guarantor
-    sms_status = {"guarantor_sms": False}
-    try:
-        message = f"Hello {guarantor.guarantor_name}, your profile has been updated successfully."
-        result = send_sms(guarantor.guarantor_phone_number, message)
-        sms_status["guarantor_sms"] = result.get("status") != "failed"
-    except Exception as e:
-        print(f"Guarantor SMS failed: {str(e)}")
+        await session.commit()
+    except IntegrityError as e:
+        await session.rollback()
+        raise integrity_http_error(e, GUARANTOR_UNIQUE, GUARANTOR_REFERENCES)
 
-    return {**guarantor.__dict__, "sms_status": sms_status}
+    await cache.delete(
+        guarantor_key(guarantor_id), client_key(previous_client_id), client_key(guarantor.client_id)
+    )
+    return guarantor
 
 @router.delete("/{guarantor_id}")
-def delete_guarantor(guarantor_id: str, session: Session = Depends(get_session)):
-    guarantor = session.get(client_model.Guarantor, guarantor_id)
+async def delete_guarantor(
+    guarantor_id: str,
+    background_tasks: BackgroundTasks,
+    session: AsyncSession = Depends(get_async_session),
+):
+    guarantor = await session.get(
+        client_model.Guarantor, guarantor_id,
+        options=[joinedload(client_model.Guarantor.client)],
+    )
     if not guarantor:
         raise HTTPException(status_code=404, detail="Guarantor not found")
 
     # Fetch related client name before deletion
     client_name = guarantor.client.client_name if hasattr(guarantor, "client") else "the client"
 
-    session.delete(guarantor)
-    session.commit()
+    # Queue SMS to guarantor
+    message = f"Hello {guarantor.guarantor_name}, you have been removed as a guarantor for {client_name}'s account."
+    queue_sms(session, guarantor.guarantor_phone_number, message)
 
-    # Send SMS to guarantor
-    sms_status = {"guarantor_sms": False}
-    try:
-        message = f"Hello {guarantor.guarantor_name}, you have been removed as a guarantor for {client_name}'s account."
-        result = send_sms(guarantor.guarantor_phone_number, message)
-        sms_status["guarantor_sms"] = result.get("status") != "failed"
-    except Exception as e:
-        print(f"Guarantor SMS failed: {str(e)}")
+    released = await release_blobs(session, client_model.Guarantor_business_photos.guarantor_id == guarantor_id)
+    await session.delete(guarantor)
+    await session.commit()
+
+    await cache.delete(guarantor_key(guarantor_id), client_key(guarantor.client_id))
+    # Photo files are removed after the response is sent
+    background_tasks.add_task(discard_photo_files, released)
 
-    return {"message": "Deleted guarantor", "sms_status": sms_status}
+    return {"message": "Deleted guarantor"}
 
 # Guarantor business photos routes
 @router.post("/{guarantor_id}/photos", response_model=client_schema.Guarantor)
+@max_body_size(MAX_UPLOAD_BODY)
 async def upload_photos(
     guarantor_id: str,
     files: List[UploadFile] = File(...),
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_async_session),
 ):
-    guarantor = session.get(client_model.Guarantor, guarantor_id)
+    # Existing photos are loaded with the guarantor, so the response needs no refresh
+    guarantor = await session.get(
+        client_model.Guarantor, guarantor_id,
+        options=[joinedload(client_model.Guarantor.guarantor_business_photos)],
+    )
 
     if not guarantor:
         raise HTTPException(404, "Guarantor not found")
 
-    os.makedirs(UPLOAD_DIR, exist_ok=True)
-
+    # Reject the whole request before anything touches the disk
+    if len(files) > MAX_PHOTOS_PER_UPLOAD:
+        raise HTTPException(413, f"At most {MAX_PHOTOS_PER_UPLOAD} photos per upload")
     for file in files:
-
         if file.content_type not in ALLOWED_TYPES:
             raise HTTPException(400, "Invalid file type")
 
-        content = await file.read()
-
-        if len(content) > MAX_FILE_SIZE:
-            raise HTTPException(400, "File too large")
-
-        file_ext = os.path.splitext(file.filename)[1]
-        filename = f"{uuid.uuid4()}{file_ext}"
-        file_path = os.path.join(UPLOAD_DIR, filename)
-
-        async with aiofiles.open(file_path, "wb") as f:
-            await f.write(content)
-
-        photo = client_model.Guarantor_business_photos(
-            guarantor_id=guarantor.guarantor_id,
-            link=file_path
-        )
-
-        session.add(photo)
-
-    session.commit()
-    session.refresh(guarantor)
+    uploads = await save_uploads(files, UPLOAD_DIR, MAX_FILE_SIZE)
+    Photo = client_model.Guarantor_business_photos
 
+    try:
+        await acquire_blobs(session, uploads)
+
+        # Bytes that were already processed for another photo reuse its WebP and thumbnail
+        processed = {
+            content_hash: (display_link, thumbnail_link)
+            for content_hash, display_link, thumbnail_link in (await session.exec(
+                select(Photo.content_hash, Photo.display_link, Photo.thumbnail_link)
+                .where(Photo.content_hash.in_({upload.content_hash for upload in uploads}))
+                .where(Photo.processing_status == client_model.PhotoStatus.ready)
+            )).all()
+        }
+
+        # All photo rows go in with a single batched insert
+        photos = []
+        for upload in uploads:
+            photo = Photo(guarantor_id=guarantor.guarantor_id, link=upload.path, content_hash=upload.content_hash)
+            if upload.content_hash in processed:
+                photo.display_link, photo.thumbnail_link = processed[upload.content_hash]
+                photo.processing_status = client_model.PhotoStatus.ready
+            photos.append(photo)
+        session.add_all(photos)
+        guarantor.guarantor_business_photos.extend(photos)
+
+        await session.commit()
+    except Exception:
+        await session.rollback()
+        await remove_created(uploads)
+        raise
+
+    await cache.delete(guarantor_key(guarantor_id))
+    notify_photos_queued()
     return guarantor
 
 @router.delete("/images/{image_id}")
-def delete_image(image_id: str, session = Depends(get_session)):
-    image = session.get(client_model.Guarantor_business_photos, image_id)
-
-    if not image:
+async def delete_image(
+    image_id: str,
+    background_tasks: BackgroundTasks,
+    session: AsyncSession = Depends(get_async_session),
+):
+    # Releasing the blob reads the photo row, which doubles as the existence check
+    released = await release_blobs(session, client_model.Guarantor_business_photos.image_id == image_id)
+    if not released:
       raise HTTPException(status_code=404, detail="Image not found")
 
-    session.delete(image)
-    session.commit()
+    await session.execute(
+        delete(client_model.Guarantor_business_photos).where(client_model.Guarantor_business_photos.image_id == image_id)
+    )
+    await session.commit()
+
+    await cache.delete(guarantor_key(released[0].guarantor_id))
+    background_tasks.add_task(discard_photo_files, released)
     return {"message": "Deleted image"}
 
 # If you want to change the guarantor business photo just delete the old one and upload a new one(no need for an update method)
\ No newline at end of file
@@ -0,0 +1,12 @@
+from fastapi import APIRouter, Response
+from core.metrics import render_metrics
+
+router = APIRouter(
+	tags=["Metrics routes"]
+	)
+
+# Prometheus scrape endpoint, merged across worker processes in multiprocess mode
+@router.get("/metrics", include_in_schema=False)
+def metrics():
+	body, content_type = render_metrics()
+	return Response(content=body, media_type=content_type)
@@ -2,7 +2,7 @@
 
 from fastapi import APIRouter, HTTPException, status
 from schemas.sms_schema import SMSRequest
-from core.sending_sms import send_sms
+from core.sending_sms import send_sms_async, is_accepted
 
 router = APIRouter(
         prefix="/sms", 
@@ -10,11 +10,11 @@ router = APIRouter(
     )
 
 @router.post("/send-sms")
-def send_sms_endpoint(req: SMSRequest):
+async def send_sms_endpoint(req: SMSRequest):
     try:
-        result = send_sms(req.phone_number, req.message)
-        # Mark as success only if status is not "failed"
-        success = result.get("status") != "failed"
+        result = await send_sms_async(req.phone_number, req.message)
+        # Mark as success only if the gateway accepted the message
+        success = is_accepted(result)
         return {"success": success, "result": result}
     except Exception as e:
         raise HTTPException(
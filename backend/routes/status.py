@@ -0,0 +1,34 @@
+from fastapi import APIRouter
+from core.database import engine, async_engine, pool_stats
+from core.cache import cache_stats
+from core.photo_gc import gc_stats
+from core.security import hash_pool_stats
+
+router = APIRouter(
+	prefix="/status",
+	tags=["Status routes"]
+	)
+
+# Connection pool usage for the request path and background jobs
+@router.get("/db-pool")
+def db_pool_status():
+	return {
+		"async": pool_stats(async_engine.sync_engine.pool),
+		"sync": pool_stats(engine.pool),
+	}
+
+# Hit, miss and eviction counts for the single-entity read cache
+@router.get("/cache")
+def cache_status():
+	return cache_stats()
+
+# Password hashing jobs waiting on or running in the process pool. Requests
+# are turned away with a 503 once queue_depth reaches max_pending.
+@router.get("/password-hashing")
+def password_hashing_status():
+	return hash_pool_stats()
+
+# Files and bytes reclaimed by the photo garbage collector, with its last sweep
+@router.get("/photo-gc")
+def photo_gc_status():
+	return gc_stats.as_dict()
\ No newline at end of file
@@ -4,6 +4,8 @@ from enum import Enum
 from typing import Optional, List
 import re
 
+from core.photo_serving import photo_url
+
 # Utility Functions
 def normalize_kenyan_phone(v: str) -> str:
     v = v.strip()
@@ -104,6 +106,16 @@ class Client_Request(BaseModel):
 class PasswordUpdate(BaseModel):
     password: str
 
+# Bulk onboarding schemas
+class BulkRowError(BaseModel):
+    row: int    # Position in the upload, starting at 1
+    errors: List[str]
+
+class BulkClientResult(BaseModel):
+    created: int
+    client_ids: List[str]
+    errors: List[BulkRowError] = []
+
 # Guarantor Schemas
 class Guarantor_Base(BaseModel):
     client_id: str
@@ -131,22 +143,49 @@ class Guarantor_Lite(BaseModel):
     guarantor_name: str
 
 # Photo Schemas
+# Links are returned as URLs under the photo mount, not as disk paths
 class GuarantorBusinessPhotoBase(BaseModel):
     guarantor_id: str
     link: str
 
+    @field_validator("link")
+    @classmethod
+    def link_to_url(cls, v):
+        return photo_url(v)
+
     class Config:
         from_attributes = True
 
 
+class PhotoStatus(str, Enum):
+    pending = "pending"
+    ready = "ready"
+    failed = "failed"
+
 class GuarantorBusinessPhoto(GuarantorBusinessPhotoBase):
     image_id: str
+    display_link: Optional[str] = None
+    thumbnail_link: Optional[str] = None
+    processing_status: PhotoStatus
     created_at: datetime
     updated_at: Optional[datetime]
 
+    @field_validator("display_link", "thumbnail_link")
+    @classmethod
+    def derived_link_to_url(cls, v):
+        return photo_url(v)
+
+# Display and thumbnail links stay empty until background processing finishes
 class GuarantorBusinessPhotoLite(BaseModel):
     image_id: str
     link: str
+    display_link: Optional[str] = None
+    thumbnail_link: Optional[str] = None
+
+    @field_validator("link", "display_link", "thumbnail_link")
+    @classmethod
+    def link_to_url(cls, v):
+        return photo_url(v)
 
 # Full Response Schemas
 class Guarantor(Guarantor_Base):
@@ -168,4 +207,9 @@ class Client(Client_Base):
     guarantors: List[Guarantor_Lite] = []
 
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+# A client with its guarantors embedded in full, for ?include= reads.
+# Photos are only present when guarantors.photos is included.
+class Client_Detail(Client):
+    guarantors: List[Guarantor] = []
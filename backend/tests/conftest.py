@@ -0,0 +1,41 @@
+import os
+import tempfile
+
+# The app reads its config at import time, so the test environment is set up
+# before anything imports it: a throwaway SQLite database served through
+# aiosqlite, no background workers, cheap password hashing and N+1 detection
+# that fails the request.
+test_dir = tempfile.mkdtemp(prefix="loan-tests-")
+os.environ.update({
+    "DB_URL": f"sqlite:///{test_dir}/test.db",
+    "DB_N_PLUS_ONE": "raise",
+    "DB_N_PLUS_ONE_THRESHOLD": "5",
+    "SERVER_TIMING_ENABLED": "true",
+    "CACHE_BACKEND": "memory",
+    "UPLOAD_DIR": f"{test_dir}/uploads",
+    "SMS_OUTBOX_DISPATCHER_ENABLED": "false",
+    "IMAGE_PROCESSOR_ENABLED": "false",
+    "PHOTO_GC_ENABLED": "false",
+    "METRICS_ENABLED": "false",
+    "ARGON2_TIME_COST": "1",
+    "ARGON2_MEMORY_COST": "1024",
+    "ARGON2_PARALLELISM": "1",
+    "PASSWORD_HASH_WORKERS": "1",
+})
+
+import pytest
+from fastapi.testclient import TestClient
+
+from main import app
+from core.cache import cache
+
+@pytest.fixture(scope="session")
+def client():
+    with TestClient(app) as test_client:
+        yield test_client
+
+# Reads are cached per id, so each test starts from a cold cache
+@pytest.fixture(autouse=True)
+def clear_cache():
+    cache.entries.clear()
+    yield
@@ -0,0 +1,101 @@
+import asyncio
+import pytest
+
+from core.cache import cache
+from test_query_counts import client_payload, create, employee_payload, guarantor_payload, query_count
+
+MISSING_ID = "00000000-0000-7000-8000-000000000000"
+
+# The client, guarantor and employee GETs share conditional_entity_response,
+# so each case runs against all three
+@pytest.fixture(params=["client", "guarantor", "employee"])
+def entity(request, client):
+    if request.param == "employee":
+        employee = create(client, "/employees/", employee_payload())
+        return "/employees/{}", employee["employee_id"], "employee_name"
+    created = create(client, "/clients/", client_payload())
+    if request.param == "client":
+        return "/clients/{}", created["client_id"], "client_name"
+    guarantor = create(client, "/guarantor/", guarantor_payload(created["client_id"]))
+    return "/guarantor/{}", guarantor["guarantor_id"], "guarantor_name"
+
+@pytest.mark.parametrize("cached", [False, True])
+def test_revalidation_answers_304(client, entity, cached):
+    path, entity_id, _ = entity
+    first = client.get(path.format(entity_id))
+    if not cached:
+        cache.entries.clear()
+    response = client.get(path.format(entity_id), headers={"If-None-Match": first.headers["etag"]})
+    assert response.status_code == 304
+    assert response.headers["etag"] == first.headers["etag"]
+    assert query_count(response) == (0 if cached else 1)
+
+@pytest.mark.parametrize("cached", [False, True])
+def test_sparse_fields(client, entity, cached):
+    path, entity_id, name_field = entity
+    full = client.get(path.format(entity_id))
+    if not cached:
+        cache.entries.clear()
+    response = client.get(f"{path.format(entity_id)}?fields={name_field}")
+    assert response.status_code == 200
+    assert response.json() == {name_field: full.json()[name_field]}
+    # Partial reads carry the same validators as the full one
+    assert response.headers["etag"] == full.headers["etag"]
+
+@pytest.mark.parametrize("query", ["", "?fields=created_at"])
+def test_missing(client, entity, query):
+    path, _, _ = entity
+    response = client.get(f"{path.format(MISSING_ID)}{query}")
+    assert response.status_code == 404
+
+# A write that invalidates the key while a miss is being read keeps that
+# read's body out of the cache
+def test_invalidation_during_read_wins(client, entity, monkeypatch):
+    path, entity_id, _ = entity
+    generation = cache.generation
+
+    async def generation_then_write(key):
+        taken = await generation(key)
+        await cache.delete(key)
+        return taken
+
+    monkeypatch.setattr(cache, "generation", generation_then_write)
+    assert client.get(path.format(entity_id)).status_code == 200
+    monkeypatch.undo()
+    assert query_count(client.get(path.format(entity_id))) > 0
+
+def test_set_is_dropped_after_delete():
+    async def run():
+        before = await cache.generation("k")
+        await cache.delete("k")
+        await cache.set("k", {"stale": True}, before)
+        assert await cache.get("k") is None
+        current = await cache.generation("k")
+        await cache.set("k", {"fresh": True}, current)
+        assert await cache.get("k") == {"fresh": True}
+
+    asyncio.run(run())
+
+# Removing a child doesn't move Last-Modified, so parents that embed
+# children only revalidate by ETag
+@pytest.mark.parametrize("cached", [False, True])
+def test_if_modified_since_ignored_once_a_child_is_removed(client, cached):
+    created = create(client, "/clients/", client_payload())
+    guarantor = create(client, "/guarantor/", guarantor_payload(created["client_id"]))
+    first = client.get(f"/clients/{created['client_id']}")
+    assert len(first.json()["guarantors"]) == 1
+    assert client.delete(f"/guarantor/{guarantor['guarantor_id']}").status_code == 200
+    if cached:
+        client.get(f"/clients/{created['client_id']}")
+    response = client.get(f"/clients/{created['client_id']}", headers={"If-Modified-Since": first.headers["last-modified"]})
+    assert response.status_code == 200
+    assert response.json()["guarantors"] == []
+
+@pytest.mark.parametrize("cached", [False, True])
+def test_if_modified_since_without_children(client, cached):
+    employee = create(client, "/employees/", employee_payload())
+    first = client.get(f"/employees/{employee['employee_id']}")
+    if not cached:
+        cache.entries.clear()
+    response = client.get(f"/employees/{employee['employee_id']}", headers={"If-Modified-Since": first.headers["last-modified"]})
+    assert response.status_code == 304
@@ -0,0 +1,100 @@
+import os
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+from sqlalchemy import update
+from sqlmodel import Session, select
+
+from core import image_processing
+from core.database import engine
+from core.image_processing import _save_webp
+from models.client_model import Guarantor_business_photos, PhotoStatus
+from test_query_counts import client_payload, create, guarantor_payload, photo_upload
+
+# Writers of the same derived file each use their own hidden temp file
+def test_concurrent_writes_of_one_target(tmp_path):
+    target = str(tmp_path / "abc_display.webp")
+    image = Image.new("RGB", (256, 256), (10, 20, 30))
+    with ThreadPoolExecutor(4) as pool:
+        list(pool.map(lambda _: _save_webp(image, target, 80), range(8)))
+    assert os.listdir(tmp_path) == ["abc_display.webp"]
+
+# A directory in the way makes the rename fail after the temp file is written
+def test_failed_write_leaves_no_temp_file(tmp_path):
+    os.mkdir(tmp_path / "abc_thumb.webp")
+    with pytest.raises(OSError):
+        _save_webp(Image.new("RGB", (16, 16)), str(tmp_path / "abc_thumb.webp"), 80)
+    assert os.listdir(tmp_path) == ["abc_thumb.webp"]
+
+# Duplicate rows share one file, so their bytes are processed once and every
+# row takes the result
+class CountingExecutor(ThreadPoolExecutor):
+    def __init__(self, before_run=None):
+        super().__init__(2)
+        self.sources = []
+        self.before_run = before_run
+
+    def submit(self, fn, source_path):
+        self.sources.append(source_path)
+        if self.before_run:
+            self.before_run()
+        return super().submit(fn, source_path)
+
+# Photos left pending by other tests would be claimed along with these
+@pytest.fixture(autouse=True)
+def no_pending_photos():
+    with Session(engine) as session:
+        session.execute(
+            update(Guarantor_business_photos)
+            .where(Guarantor_business_photos.processing_status == PhotoStatus.pending)
+            .values(processing_status=PhotoStatus.failed)
+        )
+        session.commit()
+
+def guarantor_with_photos(client, files) -> str:
+    created = create(client, "/clients/", client_payload())
+    guarantor_id = create(client, "/guarantor/", guarantor_payload(created["client_id"]))["guarantor_id"]
+    response = client.post(f"/guarantor/{guarantor_id}/photos", files=files)
+    assert response.status_code == 200, response.text
+    return guarantor_id
+
+def photo_rows(guarantor_id: str) -> list[Guarantor_business_photos]:
+    with Session(engine) as session:
+        return session.exec(
+            select(Guarantor_business_photos).where(Guarantor_business_photos.guarantor_id == guarantor_id)
+        ).all()
+
+def test_duplicates_in_one_upload_are_processed_once(client, monkeypatch):
+    executor = CountingExecutor()
+    monkeypatch.setattr(image_processing, "get_image_executor", lambda: executor)
+    guarantor_id = guarantor_with_photos(client, [photo_upload()] * 4)
+
+    claimed, guarantor_ids = image_processing.process_pending()
+    assert claimed == 4
+    assert guarantor_ids == {guarantor_id}
+    assert len(executor.sources) == 1
+    photos = photo_rows(guarantor_id)
+    assert {photo.processing_status for photo in photos} == {PhotoStatus.ready}
+    assert len({(photo.display_link, photo.thumbnail_link) for photo in photos}) == 1
+
+# A duplicate uploaded while its bytes are being processed isn't claimed on
+# its own; the run in progress updates it along with the original
+def test_duplicate_arriving_during_processing(client, monkeypatch):
+    photo = photo_upload()
+    first = guarantor_with_photos(client, [photo])
+    second = []
+    executor = CountingExecutor(lambda: second.append(guarantor_with_photos(client, [photo])))
+    monkeypatch.setattr(image_processing, "get_image_executor", lambda: executor)
+
+    assert image_processing.process_pending()[0] == 1
+    assert len(executor.sources) == 1
+    assert [row.processing_status for row in photo_rows(first) + photo_rows(second[0])] == [PhotoStatus.ready] * 2
+    assert image_processing.process_pending() == (0, set())
+
+def test_leased_bytes_are_skipped(client):
+    photo = photo_upload()
+    first = guarantor_with_photos(client, [photo])
+    with Session(engine, expire_on_commit=False) as session:
+        assert len(image_processing.claim_pending_photos(session)) == 1
+        guarantor_with_photos(client, [photo])
+        assert image_processing.claim_pending_photos(session) == []
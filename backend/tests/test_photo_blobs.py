@@ -0,0 +1,141 @@
+import io
+import os
+import time
+import asyncio
+from fastapi import UploadFile
+from sqlmodel import delete, select, update
+from sqlmodel.ext.asyncio.session import AsyncSession
+from starlette.datastructures import Headers
+
+from conftest import test_dir
+from core.database import async_engine
+from core import photo_gc
+from core.photo_gc import discard_photo_files, referenced_paths, GC_GRACE_PERIOD
+from core.uploads import ReleasedPhoto, acquire_blobs, save_uploads
+from models.client_model import PhotoBlob
+from test_query_counts import photo_upload
+
+directory = os.path.join(test_dir, "blobs")
+
+def upload_file(data: bytes) -> UploadFile:
+    return UploadFile(io.BytesIO(data), filename="photo.png", headers=Headers({"content-type": "image/png"}))
+
+async def store(session: AsyncSession, data: bytes):
+    [upload] = await save_uploads([upload_file(data)], directory, 10 * 1024 * 1024)
+    await acquire_blobs(session, [upload])
+    await session.commit()
+    return upload
+
+def temp_files() -> list[str]:
+    return [name for name in os.listdir(directory) if name.endswith(".part")]
+
+# Same bytes uploaded while a delete releases the last reference: the blob
+# row and its file go between save_upload finding the file and the new
+# reference, so the upload's own copy has to take their place
+def test_upload_racing_a_release_restores_the_file(client):
+    data = photo_upload()[1][1]
+
+    async def run():
+        async with AsyncSession(async_engine) as session:
+            stored = await store(session, data)
+
+            [upload] = await save_uploads([upload_file(data)], directory, 10 * 1024 * 1024)
+            assert not upload.created and os.path.exists(upload.temp_path)
+            await session.execute(delete(PhotoBlob).where(PhotoBlob.content_hash == stored.content_hash))
+            await session.commit()
+            os.remove(stored.path)
+
+            await acquire_blobs(session, [upload])
+            await session.commit()
+            blob = (await session.exec(select(PhotoBlob).where(PhotoBlob.content_hash == stored.content_hash))).one()
+            return upload, blob
+
+    upload, blob = asyncio.run(run())
+    assert os.path.exists(upload.path)
+    assert blob.ref_count == 1
+    assert temp_files() == []
+
+def test_duplicate_upload_drops_its_copy(client):
+    data = photo_upload()[1][1]
+
+    async def run():
+        async with AsyncSession(async_engine) as session:
+            await store(session, data)
+            stored = await store(session, data)
+            return (await session.exec(select(PhotoBlob).where(PhotoBlob.content_hash == stored.content_hash))).one()
+
+    assert asyncio.run(run()).ref_count == 2
+    assert temp_files() == []
+
+# A dead blob's file touched within the grace period is left for the collector
+def test_discard_keeps_recently_touched_files(client):
+    async def run(age: float):
+        async with AsyncSession(async_engine) as session:
+            stored = await store(session, photo_upload()[1][1])
+            await session.execute(delete(PhotoBlob).where(PhotoBlob.content_hash == stored.content_hash))
+            await session.execute(PhotoBlob.__table__.insert().values(
+                content_hash=stored.content_hash, path=stored.path, size=stored.size, ref_count=0,
+            ))
+            await session.commit()
+        modified = time.time() - age
+        os.utime(stored.path, (modified, modified))
+        await discard_photo_files([ReleasedPhoto(stored.content_hash, stored.path, None, None, "")])
+        return stored
+
+    assert os.path.exists(asyncio.run(run(0)).path)
+    assert not os.path.exists(asyncio.run(run(GC_GRACE_PERIOD + 60)).path)
+
+async def store_released(data: bytes, age: float):
+    async with AsyncSession(async_engine) as session:
+        stored = await store(session, data)
+        await session.execute(update(PhotoBlob).where(PhotoBlob.content_hash == stored.content_hash).values(ref_count=0))
+        await session.commit()
+    age_file(stored.path, age)
+    return stored
+
+def age_file(path: str, age: float) -> None:
+    modified = time.time() - age
+    os.utime(path, (modified, modified))
+
+async def blob_row(content_hash: str):
+    async with AsyncSession(async_engine) as session:
+        return (await session.exec(select(PhotoBlob).where(PhotoBlob.content_hash == content_hash))).first()
+
+# A duplicate upload between the collector's walk and its unlink takes a
+# reference on the blob before its photo row exists. The locked blob row
+# keeps the file, even once its mtime is old again.
+def test_collector_keeps_a_blob_referenced_during_the_walk(client, monkeypatch):
+    data = photo_upload()[1][1]
+    stored = asyncio.run(store_released(data, GC_GRACE_PERIOD + 60))
+
+    def upload_then_check(session, paths):
+        async def duplicate():
+            async with AsyncSession(async_engine) as upload_session:
+                await store(upload_session, data)
+        asyncio.run(duplicate())
+        age_file(stored.path, GC_GRACE_PERIOD + 60)
+        return referenced_paths(session, paths)
+
+    monkeypatch.setattr(photo_gc, "referenced_paths", upload_then_check)
+    photo_gc.collect_garbage(directory)
+    assert os.path.exists(stored.path)
+    assert asyncio.run(blob_row(stored.content_hash)).ref_count == 1
+
+# Touched during the walk, without a reference yet: the second stat keeps it
+def test_collector_restats_before_unlinking(client, monkeypatch):
+    stored = asyncio.run(store_released(photo_upload()[1][1], GC_GRACE_PERIOD + 60))
+
+    def touch_then_check(session, paths):
+        os.utime(stored.path)
+        return referenced_paths(session, paths)
+
+    monkeypatch.setattr(photo_gc, "referenced_paths", touch_then_check)
+    photo_gc.collect_garbage(directory)
+    assert os.path.exists(stored.path)
+
+# An unreferenced blob goes with its file, so a later upload creates it afresh
+def test_collector_removes_a_dead_blob_with_its_file(client):
+    stored = asyncio.run(store_released(photo_upload()[1][1], GC_GRACE_PERIOD + 60))
+    photo_gc.collect_garbage(directory)
+    assert not os.path.exists(stored.path)
+    assert asyncio.run(blob_row(stored.content_hash)) is None
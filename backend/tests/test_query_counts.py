@@ -0,0 +1,285 @@
+import io
+import re
+import pytest
+from PIL import Image
+
+# Statements per endpoint, read from the Server-Timing header. The counts are
+# fixed whatever the number of rows: a query that starts running per row
+# changes them, and DB_N_PLUS_ONE=raise fails the request once the same
+# statement repeats five times.
+
+SERVER_TIMING_QUERIES = re.compile(r'db;[^,]*desc="(\d+) queries"')
+sequence = iter(range(10_000_000, 99_999_999))
+
+def query_count(response) -> int:
+    return int(SERVER_TIMING_QUERIES.search(response.headers["server-timing"]).group(1))
+
+def client_payload(**overrides) -> dict:
+    n = next(sequence)
+    payload = {
+        "client_name": f"Client {n}",
+        "national_id_number": str(n),
+        "client_phone_number": f"07{n}",
+        "client_business_name": "Shop",
+        "client_residence": "Town",
+        "password": "secret",
+        "date_of_birth": "1990-01-01",
+        "next_of_kin_name": "Kin",
+        "next_of_kin_contact": f"01{n}",
+        "marital_status": "single",
+        "number_of_children": 0,
+    }
+    payload.update(overrides)
+    return payload
+
+def guarantor_payload(client_id: str, **overrides) -> dict:
+    n = next(sequence)
+    payload = {
+        "client_id": client_id,
+        "guarantor_name": f"Guarantor {n}",
+        "national_id_number": str(n),
+        "guarantor_phone_number": f"07{n}",
+        "guarantor_business_name": "Stall",
+        "guarantor_business_location": "Market",
+    }
+    payload.update(overrides)
+    return payload
+
+def employee_payload(**overrides) -> dict:
+    n = next(sequence)
+    payload = {
+        "employee_name": f"Employee {n}",
+        "employee_phone_number": f"07{n}",
+        "employee_type": "admin",
+        "password_hash": "secret",
+    }
+    payload.update(overrides)
+    return payload
+
+def create(client, path: str, payload: dict) -> dict:
+    response = client.post(path, json=payload)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+# More rows than the N+1 threshold, two guarantors per client
+@pytest.fixture(scope="module")
+def seeded(client):
+    clients = [create(client, "/clients/", client_payload()) for _ in range(6)]
+    guarantors = [
+        create(client, "/guarantor/", guarantor_payload(c["client_id"]))
+        for c in clients for _ in range(2)
+    ]
+    employees = [create(client, "/employees/", employee_payload()) for _ in range(6)]
+    return {"clients": clients, "guarantors": guarantors, "employees": employees}
+
+# Reads
+
+@pytest.mark.parametrize("path, queries", [
+    ("/clients/", 2),
+    ("/clients/?fields=client_name", 1),
+    ("/guarantor/", 2),
+    ("/employees/", 1),
+])
+@pytest.mark.parametrize("limit", [2, 6])
+def test_list_queries_dont_grow_with_page_size(client, seeded, path, queries, limit):
+    separator = "&" if "?" in path else "?"
+    response = client.get(f"{path}{separator}limit={limit}")
+    assert response.status_code == 200, response.text
+    assert len(response.json()) == limit
+    assert query_count(response) == queries
+
+def test_list_guarantors_of_client(client, seeded):
+    response = client.get(f"/guarantor/?client_id={seeded['clients'][0]['client_id']}")
+    assert response.status_code == 200
+    assert len(response.json()) == 2
+    assert query_count(response) == 2
+
+@pytest.mark.parametrize("path, key, queries", [
+    ("/clients/{}", "clients", 2),
+    ("/guarantor/{}", "guarantors", 2),
+    ("/employees/{}", "employees", 1),
+])
+def test_get_then_cached(client, seeded, path, key, queries):
+    item = seeded[key][0]
+    url = path.format(item[f"{key[:-1]}_id"])
+    first = client.get(url)
+    assert first.status_code == 200
+    assert query_count(first) == queries
+    second = client.get(url)
+    assert second.status_code == 200
+    assert query_count(second) == 0
+
+@pytest.mark.parametrize("include, queries", [
+    ("guarantors", 2),
+    ("guarantors.photos", 3),
+])
+def test_get_client_with_includes(client, seeded, include, queries):
+    response = client.get(f"/clients/{seeded['clients'][0]['client_id']}?include={include}")
+    assert response.status_code == 200
+    assert len(response.json()["guarantors"]) == 2
+    assert query_count(response) == queries
+
+def test_get_missing_client(client):
+    response = client.get("/clients/00000000-0000-7000-8000-000000000000")
+    assert response.status_code == 404
+    assert query_count(response) == 1
+
+# Writes. Each one is an insert or a primary-key read followed by the write
+# and the queued SMS; uniqueness and references are left to the constraints.
+
+# A different image each time, so every photo has its own blob
+def photo_upload() -> tuple:
+    n = next(sequence)
+    image = io.BytesIO()
+    Image.new("RGB", (64, 48), (n % 256, n // 256 % 256, n // 65536 % 256)).save(image, "PNG")
+    return ("files", (f"{n}.png", image.getvalue(), "image/png"))
+
+def test_create_client(client):
+    response = client.post("/clients/", json=client_payload())
+    assert response.status_code == 200, response.text
+    assert query_count(response) == 2
+
+def test_create_duplicate_client(client):
+    payload = create(client, "/clients/", client_payload())
+    response = client.post("/clients/", json=client_payload(national_id_number=payload["national_id_number"]))
+    assert response.status_code == 409
+    assert query_count(response) == 1
+
+def test_update_client(client):
+    payload = client_payload()
+    created = create(client, "/clients/", payload)
+    response = client.put(f"/clients/{created['client_id']}", json={**payload, "client_name": "Renamed"})
+    assert response.status_code == 200, response.text
+    assert query_count(response) == 3
+
+def test_update_client_password(client):
+    created = create(client, "/clients/", client_payload())
+    response = client.patch(f"/clients/{created['client_id']}/password", json={"password": "changed"})
+    assert response.status_code == 200, response.text
+    assert query_count(response) == 3
+
+def test_delete_client(client):
+    created = create(client, "/clients/", client_payload())
+    response = client.delete(f"/clients/{created['client_id']}")
+    assert response.status_code == 200, response.text
+    assert query_count(response) == 5
+
+# Guarantors and their photos go with the database cascade. The photos'
+# blobs are released with one read and one update, however many there are.
+def test_delete_client_with_guarantors_and_photos(client):
+    created = create(client, "/clients/", client_payload())
+    for _ in range(3):
+        guarantor = create(client, "/guarantor/", guarantor_payload(created["client_id"]))
+        upload = client.post(f"/guarantor/{guarantor['guarantor_id']}/photos", files=[photo_upload(), photo_upload()])
+        assert upload.status_code == 200, upload.text
+    response = client.delete(f"/clients/{created['client_id']}")
+    assert response.status_code == 200, response.text
+    assert query_count(response) == 6
+
+def test_create_guarantor(client):
+    created = create(client, "/clients/", client_payload())
+    response = client.post("/guarantor/", json=guarantor_payload(created["client_id"]))
+    assert response.status_code == 200, response.text
+    assert query_count(response) == 3
+
+def test_create_guarantor_for_missing_client(client):
+    response = client.post("/guarantor/", json=guarantor_payload("00000000-0000-7000-8000-000000000000"))
+    assert response.status_code == 404
+    assert query_count(response) == 1
+
+def test_update_guarantor(client):
+    created = create(client, "/clients/", client_payload())
+    payload = guarantor_payload(created["client_id"])
+    guarantor = create(client, "/guarantor/", payload)
+    response = client.put(f"/guarantor/{guarantor['guarantor_id']}", json={**payload, "guarantor_name": "Renamed"})
+    assert response.status_code == 200, response.text
+    assert query_count(response) == 3
+
+def test_delete_guarantor_with_photos(client):
+    created = create(client, "/clients/", client_payload())
+    guarantor = create(client, "/guarantor/", guarantor_payload(created["client_id"]))
+    upload = client.post(f"/guarantor/{guarantor['guarantor_id']}/photos", files=[photo_upload() for _ in range(6)])
+    assert upload.status_code == 200, upload.text
+    response = client.delete(f"/guarantor/{guarantor['guarantor_id']}")
+    assert response.status_code == 200, response.text
+    assert query_count(response) == 5
+
+def test_create_employee(client):
+    response = client.post("/employees/", json=employee_payload())
+    assert response.status_code == 200, response.text
+    assert query_count(response) == 2
+
+def test_create_duplicate_employee(client):
+    employee = create(client, "/employees/", employee_payload())
+    response = client.post("/employees/", json=employee_payload(employee_phone_number=employee["employee_phone_number"]))
+    assert response.status_code == 409
+    assert query_count(response) == 1
+
+@pytest.mark.parametrize("path, body", [
+    ("password", {"password": "changed"}),
+    ("phone_number", {"phone_number": "0799000001"}),
+])
+def test_update_employee(client, path, body):
+    employee = create(client, "/employees/", employee_payload())
+    response = client.patch(f"/employees/{employee['employee_id']}/{path}", json=body)
+    assert response.status_code == 200, response.text
+    assert query_count(response) == 3
+
+def test_delete_employee(client):
+    employee = create(client, "/employees/", employee_payload())
+    response = client.delete(f"/employees/{employee['employee_id']}")
+    assert response.status_code == 200, response.text
+    assert query_count(response) == 3
+
+# The duplicate check's transaction is over before the passwords are hashed,
+# so a large import doesn't hold a pooled connection for the whole hashing
+def test_bulk_onboarding_releases_connection_while_hashing(client, monkeypatch):
+    import routes.client
+    from core.database import async_engine
+
+    hash_passwords_async = routes.client.hash_passwords_async
+    checked_out = []
+
+    async def hash_and_check(passwords):
+        checked_out.append(async_engine.pool.checkedout())
+        return await hash_passwords_async(passwords)
+
+    monkeypatch.setattr(routes.client, "hash_passwords_async", hash_and_check)
+    existing = create(client, "/clients/", client_payload())
+    response = client.post("/clients/bulk", json=[client_payload() for _ in range(8)] + [
+        client_payload(national_id_number=existing["national_id_number"]),
+    ])
+    assert response.status_code == 200, response.text
+    assert response.json()["created"] == 8
+    assert checked_out == [0]
+    # The duplicate check, then per chunk the rows and their SMS inside a savepoint
+    assert query_count(response) == 5
+
+# Single password changes hash before their first query, for the same reason
+@pytest.mark.parametrize("module, path, method, body", [
+    ("routes.client", "/clients/{}/password", "patch", lambda payload: {"password": "changed"}),
+    ("routes.client", "/clients/{}", "put", lambda payload: {**payload, "password": "changed"}),
+    ("routes.employee", "/employees/{}/password", "patch", lambda payload: {"password": "changed"}),
+])
+def test_password_change_releases_connection_while_hashing(client, monkeypatch, module, path, method, body):
+    import importlib
+    from core.database import async_engine
+
+    routes_module = importlib.import_module(module)
+    hash_password_async = routes_module.hash_password_async
+    checked_out = []
+
+    async def hash_and_check(password):
+        checked_out.append(async_engine.pool.checkedout())
+        return await hash_password_async(password)
+
+    if module == "routes.client":
+        payload = client_payload()
+        entity_id = create(client, "/clients/", payload)["client_id"]
+    else:
+        payload = employee_payload()
+        entity_id = create(client, "/employees/", payload)["employee_id"]
+    monkeypatch.setattr(routes_module, "hash_password_async", hash_and_check)
+    response = client.request(method, path.format(entity_id), json=body(payload))
+    assert response.status_code == 200, response.text
+    assert checked_out == [0]
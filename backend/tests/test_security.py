@@ -0,0 +1,18 @@
+import asyncio
+from pwdlib import PasswordHash
+from pwdlib.hashers.argon2 import Argon2Hasher
+
+from core.security import hash_password, verify_and_update_password, verify_and_update_password_async
+
+# A hash made with other Argon2 parameters verifies and comes back upgraded
+def test_outdated_hash_is_upgraded():
+    outdated = PasswordHash((Argon2Hasher(time_cost=2, memory_cost=2048, parallelism=1),)).hash("secret")
+    valid, new_hash = verify_and_update_password("secret", outdated)
+    assert valid
+    assert new_hash is not None and new_hash != outdated
+    assert verify_and_update_password("secret", new_hash) == (True, None)
+
+def test_current_hash_is_kept():
+    current = hash_password("secret")
+    assert asyncio.run(verify_and_update_password_async("secret", current)) == (True, None)
+    assert asyncio.run(verify_and_update_password_async("wrong", current)) == (False, None)
@@ -0,0 +1,32 @@
+from core.cache import cache
+from test_query_counts import client_payload, create, employee_payload, guarantor_payload, photo_upload
+
+TIMESTAMPS = ("created_at", "updated_at")
+
+def assert_same_timestamps(client, written: dict, path: str) -> None:
+    cache.entries.clear()
+    read = client.get(path).json()
+    assert {key: written[key] for key in TIMESTAMPS} == {key: read[key] for key in TIMESTAMPS}
+
+# Writes answer with the same timestamps that reads of the row return
+def test_client_writes(client):
+    payload = client_payload()
+    created = create(client, "/clients/", payload)
+    assert_same_timestamps(client, created, f"/clients/{created['client_id']}")
+    updated = client.put(f"/clients/{created['client_id']}", json={**payload, "client_name": "Renamed"}).json()
+    assert_same_timestamps(client, updated, f"/clients/{created['client_id']}")
+
+def test_guarantor_writes(client):
+    created = create(client, "/clients/", client_payload())
+    payload = guarantor_payload(created["client_id"])
+    guarantor = create(client, "/guarantor/", payload)
+    path = f"/guarantor/{guarantor['guarantor_id']}"
+    assert_same_timestamps(client, guarantor, path)
+    updated = client.put(path, json={**payload, "guarantor_name": "Renamed"}).json()
+    assert_same_timestamps(client, updated, path)
+    uploaded = client.post(f"{path}/photos", files=[photo_upload()]).json()
+    assert_same_timestamps(client, uploaded, path)
+
+def test_employee_writes(client):
+    employee = create(client, "/employees/", employee_payload())
+    assert_same_timestamps(client, employee, f"/employees/{employee['employee_id']}")
@@ -0,0 +1,37 @@
+import pytest
+
+import routes.guarantor
+from test_query_counts import client_payload, create, guarantor_payload, photo_upload
+
+LIMIT = 16 * 1024
+
+@pytest.fixture
+def guarantor_id(client, monkeypatch):
+    monkeypatch.setattr(routes.guarantor.upload_photos, "max_body_size", LIMIT)
+    created = create(client, "/clients/", client_payload())
+    return create(client, "/guarantor/", guarantor_payload(created["client_id"]))["guarantor_id"]
+
+def multipart(size: int) -> tuple[bytes, str]:
+    boundary = "limit-test"
+    body = (
+        f"--{boundary}\r\nContent-Disposition: form-data; name=\"files\"; filename=\"big.png\"\r\n"
+        f"Content-Type: image/png\r\n\r\n"
+    ).encode() + b"0" * size + f"\r\n--{boundary}--\r\n".encode()
+    return body, f"multipart/form-data; boundary={boundary}"
+
+def test_declared_length_over_the_limit_is_refused(client, guarantor_id):
+    body, content_type = multipart(LIMIT * 4)
+    response = client.post(f"/guarantor/{guarantor_id}/photos", content=body, headers={"content-type": content_type})
+    assert response.status_code == 413
+
+# Without a Content-Length the body is counted as it arrives
+def test_chunked_body_over_the_limit_is_cut_off(client, guarantor_id):
+    body, content_type = multipart(LIMIT * 4)
+    chunks = (body[i:i + 4096] for i in range(0, len(body), 4096))
+    response = client.post(f"/guarantor/{guarantor_id}/photos", content=chunks, headers={"content-type": content_type})
+    assert response.status_code == 413
+
+def test_upload_within_the_limit(client, guarantor_id):
+    response = client.post(f"/guarantor/{guarantor_id}/photos", files=[photo_upload()])
+    assert response.status_code == 200, response.text
+    assert len(response.json()["guarantor_business_photos"]) == 1